@@ -1,27 +1,89 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from contextlib import asynccontextmanager
-from models.rag_handler import RAGHandler
-from routes.user_routes import router as user_router
-from db import close_connection
-from datetime import datetime
-from bson import ObjectId
-from db import users_collection
-
-# Initialize RAG handler
-rag_handler = RAGHandler()
+import logging
+import os
+
+from models.startup_timer import StartupTimer
+
+# Per-request RAG detail (queries, chunk previews) is logged at DEBUG
+logging.basicConfig(
+    level=os.getenv("RAG_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s"
+)
+logger = logging.getLogger("app")
+
+# Started before the remaining imports so their cost shows up in the report
+startup_timer = StartupTimer()
+
+with startup_timer.phase("import_app_modules"):
+    from fastapi import FastAPI, HTTPException
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+    from pydantic import BaseModel
+    from contextlib import asynccontextmanager
+    from models.rag_handler import RAGHandler
+    from models.async_rag_handler import AsyncRAGHandler
+    from models.metrics import METRICS
+    from routes.user_routes import get_compactor, router as user_router
+    from db import close_connection
+    from datetime import datetime
+    from typing import Dict, List, Optional
+    import asyncio
+    import json
+    from bson import ObjectId
+    from db import users_collection
+
+# The RAG pipeline loads in the background after the app starts serving;
+# /health/ready reports when it can take requests
+rag_handler = None
+async_rag = None
+rag_status = "starting"
+rag_error = None
+
+
+def load_rag_pipeline():
+    """Build the RAG handler and warm it up. Runs on a worker thread."""
+    handler = RAGHandler(startup_timer=startup_timer)
+    handler.warmup()
+    return handler
+
+
+async def start_rag_pipeline():
+    global rag_handler, async_rag, rag_status, rag_error
+    try:
+        loop = asyncio.get_running_loop()
+        rag_handler = await loop.run_in_executor(None, load_rag_pipeline)
+        async_rag = AsyncRAGHandler(rag_handler)
+        rag_status = "ready"
+        logger.info("RAG pipeline ready: %s", startup_timer.report())
+    except Exception as e:
+        rag_status = "failed"
+        rag_error = str(e)
+        logger.error("RAG pipeline failed to load: %s", rag_error)
+
+
+def require_rag() -> AsyncRAGHandler:
+    """Return the async RAG handler, or answer 503 while it is still loading."""
+    if rag_status != "ready":
+        raise HTTPException(status_code=503, detail=f"RAG pipeline is {rag_status}")
+    return async_rag
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup actions (if needed)
+    loader = asyncio.create_task(start_rag_pipeline())
     yield
     # Shutdown actions
+    loader.cancel()
     await close_connection()
-    rag_handler.close()
+    if async_rag is not None:
+        await async_rag.close()
+    if rag_handler is not None:
+        rag_handler.close()
 
 # Initialize FastAPI with lifespan
 app = FastAPI(lifespan=lifespan)
+# Routers reach the RAG pipeline through request.app.state; they cannot import this module
+app.state.require_rag = require_rag
 
 # Enable CORS
 app.add_middleware(
@@ -50,10 +112,101 @@ async def shutdown():
 async def root():
     return {"message": "Welcome to TooturAI Backend"}
 
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving requests."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Ready once the embedding model, vectors and warmup have finished loading."""
+    body = {"status": rag_status, "startup": startup_timer.report()}
+    if rag_error:
+        body["error"] = rag_error
+    return JSONResponse(body, status_code=200 if rag_status == "ready" else 503)
+
+@app.get("/rag/stats")
+async def rag_stats():
+    """Cache counters for the RAG pipeline."""
+    require_rag()
+    return {
+        "query_cache": rag_handler.query_cache.stats(),
+        "response_cache": rag_handler.response_cache.stats(),
+        "encoder": rag_handler.encoder.stats(),
+        "context": rag_handler.context_builder.stats(),
+        "reranker": rag_handler.reranker.stats() if rag_handler.reranker is not None else None,
+        "llm": rag_handler.llm.stats(),
+        "hedging": rag_handler.hedged_llm.stats(),
+        "working_set": rag_handler.working_set_stats(),
+        "coalescing": async_rag.coalescing_stats(),
+        "compactor": get_compactor().stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms and MongoDB round trips, in Prometheus text format."""
+    for phase, seconds in startup_timer.phases.items():
+        METRICS.set_gauge("rag_startup_phase_seconds", seconds, phase=phase)
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
 class StudyGuideRequest(BaseModel):
     email: str  # Ensure email is required
     user_prompt: str
     study_guide_id: str = None  # Optional for follow-ups
+    course: Optional[str] = None  # e.g. "biology"; inferred from the prompt when omitted
+
+
+async def load_working_set(email: str, study_guide_id: str) -> List[Dict]:
+    """The chunks a saved study guide has retrieved so far; 404 if the guide does not exist."""
+    user = await users_collection.find_one(
+        {"email": email, "study_guides._id": study_guide_id},
+        {"study_guides.$": 1}
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="Study guide not found")
+    return user["study_guides"][0].get("working_set", [])
+
+
+async def save_guide_response(email: str, user_prompt: str, study_guide_id: Optional[str], new_response: str,
+                              working_set: Optional[List[Dict]] = None) -> dict:
+    """Append a response to an existing study guide, or start a new guide with it."""
+    # If modifying an existing study guide, append to it
+    if study_guide_id:
+        guide = await users_collection.find_one(
+            {"email": email, "study_guides._id": study_guide_id}
+        )
+
+        if not guide:
+            raise HTTPException(status_code=404, detail="Study guide not found")
+
+        # Append conversation history, and keep the chunks retrieved for the next follow-up
+        update = {"$push": {"study_guides.$.conversation": {"user_prompt": user_prompt, "response": new_response}}}
+        if working_set is not None:
+            update["$set"] = {"study_guides.$.working_set": working_set}
+        await users_collection.update_one(
+            {"email": email, "study_guides._id": study_guide_id},
+            update
+        )
+
+        return {"message": "Response added to existing study guide", "response": new_response}
+
+    # Create a new study guide session
+    new_study_guide = {
+        "_id": str(ObjectId()),  
+        "title": user_prompt[:50],  # Use first few words as title
+        "conversation": [{"user_prompt": user_prompt, "response": new_response}],
+        "working_set": working_set or [],
+        "created_at": datetime.utcnow()
+    }
+
+    # Store new study guide in database
+    await users_collection.update_one(
+        {"email": email},
+        {"$push": {"study_guides": new_study_guide}},
+        upsert=True
+    )
+
+    return {"message": "New study guide created", "study_guide": new_study_guide}
 
 
 @app.post("/generate-guide")
@@ -68,50 +221,64 @@ async def generate_guide(request: StudyGuideRequest):
         if not email:
             raise HTTPException(status_code=400, detail="Email is required")
 
-        # Generate AI response using RAG
-        new_response = rag_handler.generate_response_with_context(user_prompt)
-
-        # If modifying an existing study guide, append to it
-        if study_guide_id:
-            guide = await users_collection.find_one(
-                {"email": email, "study_guides._id": study_guide_id}
-            )
-
-            if not guide:
-                raise HTTPException(status_code=404, detail="Study guide not found")
-
-            # Append conversation history
-            await users_collection.update_one(
-                {"email": email, "study_guides._id": study_guide_id},
-                {"$push": {"study_guides.$.conversation": {"user_prompt": user_prompt, "response": new_response}}}
-            )
-
-            return {"message": "Response added to existing study guide", "response": new_response}
-
-        # Create a new study guide session
-        new_study_guide = {
-            "_id": str(ObjectId()),  
-            "title": user_prompt[:50],  # Use first few words as title
-            "conversation": [{"user_prompt": user_prompt, "response": new_response}],
-            "created_at": datetime.utcnow()
-        }
+        # Follow-ups retrieve from the chunks the guide already has before searching the corpus
+        rag = require_rag()
+        working_set = await load_working_set(email, study_guide_id) if study_guide_id else None
 
-        # Store new study guide in database
-        await users_collection.update_one(
-            {"email": email},
-            {"$push": {"study_guides": new_study_guide}},
-            upsert=True
-        )
+        # Generate AI response using RAG
+        new_response, working_set = await rag.generate_with_working_set(user_prompt, request.course, working_set)
 
-        return {"message": "New study guide created", "study_guide": new_study_guide}
+        return await save_guide_response(email, user_prompt, study_guide_id, new_response, working_set)
 
+    except HTTPException:
+        # 400/404, and 503 while the pipeline loads, keep their status
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event: dict) -> str:
+    """Format one server-sent event carrying a JSON payload."""
+    return f"data: {json.dumps(jsonable_encoder(event))}\n\n"
+
+
+@app.post("/generate-guide/stream")
+async def generate_guide_stream(request: StudyGuideRequest):
+    """
+    Streaming /generate-guide over server-sent events: retrieval metadata
+    first, then tokens as they arrive, then a "done" event once the full
+    response has been saved to the study guide.
+    """
+    if not request.email:
+        raise HTTPException(status_code=400, detail="Email is required")
+    rag = require_rag()
+    working_set = await load_working_set(request.email, request.study_guide_id) if request.study_guide_id else None
+
+    async def events():
+        try:
+            async for event in rag.stream_response_with_context(request.user_prompt, request.course, working_set):
+                if event["type"] == "done":
+                    saved = await save_guide_response(
+                        request.email, request.user_prompt, request.study_guide_id, event["response"],
+                        event.pop("working_set", None)
+                    )
+                    event = {**event, **saved}
+                yield sse_event(event)
+        except Exception as e:
+            # The 200 and its headers are already sent, so the failure has to travel as an event
+            logger.exception("Error in generate-guide stream")
+            yield sse_event({"type": "error", "detail": f"An unexpected error occurred: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/test-rag")
 async def test_rag(prompt: Prompt):
     """Test endpoint to verify RAG functionality with detailed logging"""
     try:
+        rag = require_rag()
         print("\n=== Testing RAG System ===")
         print(f"Received prompt: {prompt.user_prompt}")
         
@@ -121,7 +288,7 @@ async def test_rag(prompt: Prompt):
         print(f"Found {chunks_count} documents in users collection")
         
         # Get RAG response with all the logging we added
-        response = rag_handler.generate_response_with_context(prompt.user_prompt)
+        response = await rag.generate_response_with_context(prompt.user_prompt)
         
         return {
             "status": "success",
@@ -129,6 +296,8 @@ async def test_rag(prompt: Prompt):
             "response": response,
             "message": "Check server logs for detailed RAG process information"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in test-rag endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
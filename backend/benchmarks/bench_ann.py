@@ -0,0 +1,77 @@
+"""
+Recall and latency of the ANN index backends against exact search.
+
+Reports recall@k against exhaustive cosine search plus p50/p99 single-query
+latency for each backend. Run from the backend directory:
+    python -m benchmarks.bench_ann --size 200000 --top-k 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from models.ann_index import AnnIndex
+from models.vector_store import normalize_rows, top_k_indices
+
+DIM = 384
+
+
+def synthetic_corpus(rng, size, clusters=300):
+    """Clustered unit vectors, closer to real sentence embeddings than uniform noise."""
+    centers = rng.standard_normal((clusters, DIM), dtype=np.float32)
+    assignment = rng.integers(0, clusters, size)
+    vectors = centers[assignment] + 0.6 * rng.standard_normal((size, DIM), dtype=np.float32)
+    return normalize_rows(vectors)
+
+
+def percentiles(timings_ms):
+    return np.percentile(timings_ms, 50), np.percentile(timings_ms, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--kinds", nargs="+", default=["hnsw", "ivf"])
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSW efSearch override")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF nprobe override")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = synthetic_corpus(rng, args.size)
+    queries = normalize_rows(corpus[rng.integers(0, args.size, args.queries)]
+                             + 0.3 * rng.standard_normal((args.queries, DIM), dtype=np.float32))
+    ids = [str(i) for i in range(args.size)]
+
+    exact_timings, truth = [], []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(set(top_k_indices(corpus @ query, args.top_k).tolist()))
+        exact_timings.append((time.perf_counter() - start) * 1000)
+
+    print(f"{args.size} chunks, {args.queries} queries, k={args.top_k}")
+    print(f"{'backend':>8} {'build s':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    p50, p99 = percentiles(exact_timings)
+    print(f"{'exact':>8} {0.0:>8.1f} {1.0:>9.3f} {p50:>8.3f} {p99:>8.3f}")
+
+    for kind in args.kinds:
+        start = time.perf_counter()
+        ann_index = AnnIndex.build(corpus, ids, kind=kind)
+        build_s = time.perf_counter() - start
+        ann_index.set_search_params(ef_search=args.ef_search, nprobe=args.nprobe)
+
+        timings, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = ann_index.search(query[None, :], args.top_k)[0]
+            timings.append((time.perf_counter() - start) * 1000)
+            hits += len(expected & {int(chunk_id) for chunk_id, _ in found})
+
+        p50, p99 = percentiles(timings)
+        recall = hits / (args.top_k * len(queries))
+        print(f"{kind:>8} {build_s:>8.1f} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
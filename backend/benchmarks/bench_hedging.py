@@ -0,0 +1,96 @@
+"""
+Tail latency of LLM calls with and without hedging and a deadline.
+
+Starts the fake OpenAI server in-process with a share of very slow requests
+(--slow-rate, --slow-ms) and sends --requests chat completions through one
+gateway three ways: plain, hedged (a second request after the recent
+--percentile latency), and with a --deadline that falls back to another
+model. The plain run goes first so the gateway has latency samples to
+hedge from. Reports p50/p99/max latency, the hedge and win rates, and how
+many requests the server received, which is the extra spend. Run from the
+backend directory:
+    python -m benchmarks.bench_hedging --requests 200 --slow-rate 0.03
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.bench_ann import percentiles
+from benchmarks.bench_llm_gateway import start_server
+from benchmarks.fake_openai_server import create_app
+from models.hedged_llm import HedgedLLM
+from models.llm_gateway import LLMGateway
+
+
+async def run(llm: HedgedLLM, requests: int, clients: int):
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    timings, failures = [], 0
+
+    async def client():
+        nonlocal failures
+        while not queue.empty():
+            i = queue.get_nowait()
+            messages = [{"role": "user", "content": f"Explain topic {i} of AP Chemistry"}]
+            start = time.perf_counter()
+            try:
+                await llm.achat(messages, model="gpt-4", max_tokens=50)
+                timings.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return timings, failures
+
+
+async def compare(configs, requests: int, clients: int, stats_url: str):
+    """Run each (name, HedgedLLM) in turn on one event loop, which the gateway's async pool is bound to."""
+    for name, llm in configs:
+        sent_before = httpx.get(stats_url).json()["requests"]
+        timings, failures = await run(llm, requests, clients)
+        sent = httpx.get(stats_url).json()["requests"] - sent_before
+        p50, p99 = percentiles(timings) if timings else (0.0, 0.0)
+        stats = llm.stats()
+        print(f"{name:>8}: p50 {p50:.0f}ms p99 {p99:.0f}ms max {max(timings, default=0):.0f}ms, "
+              f"{failures} failed, {sent} server requests for {requests} calls, "
+              f"hedge rate {stats['hedge_rate']:.1%} (won {stats['win_rate']:.0%}), "
+              f"{stats['fallbacks']} fallbacks")
+        llm.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8012)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent callers")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="share of requests that are slow")
+    parser.add_argument("--slow-ms", type=float, default=3000.0, help="extra latency of a slow request")
+    parser.add_argument("--percentile", type=float, default=95, help="hedge after this recent latency percentile")
+    parser.add_argument("--deadline", type=float, default=1.0, help="seconds before falling back")
+    parser.add_argument("--fallback-model", default="gpt-4o-mini")
+    args = parser.parse_args()
+
+    app = create_app(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 5, slow_rate=args.slow_rate,
+                     slow_ms=args.slow_ms, seed=0)
+    server, thread = start_server(app, args.port)
+    gateway = LLMGateway(api_key="fake", base_url=f"http://127.0.0.1:{args.port}/v1", max_concurrency=32,
+                         backoff_base=0.1, backoff_max=2.0, timeout=30.0)
+    configs = [
+        ("plain", HedgedLLM(gateway)),
+        ("hedged", HedgedLLM(gateway, hedging=True, hedge_percentile=args.percentile, min_hedge_delay=0.0)),
+        ("deadline", HedgedLLM(gateway, deadline=args.deadline, fallback_model=args.fallback_model))
+    ]
+    try:
+        asyncio.run(compare(configs, args.requests, args.clients, f"http://127.0.0.1:{args.port}/stats"))
+    finally:
+        gateway.close()
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Latency of hybrid BM25 + dense retrieval against dense-only retrieval.
+
+Builds a synthetic corpus of clustered vectors with Zipf-distributed chunk
+texts, then reports p50/p99 single-query latency for dense top k, for the
+BM25 search alone and for the full hybrid path (dense pool, BM25 pool,
+fusion). Run from the backend directory:
+    python -m benchmarks.bench_hybrid --size 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_ann import DIM, percentiles, synthetic_corpus
+from models.lexical_index import LexicalIndexBuilder
+from models.vector_store import normalize_rows, rescored_top_k
+
+
+def synthetic_texts(rng, size, vocabulary=30_000, mean_length=300):
+    """Chunk texts whose term frequencies follow a Zipf curve, like real prose."""
+    words = np.array([f"term{i}" for i in range(vocabulary)])
+    weights = 1.0 / np.arange(1, vocabulary + 1)
+    weights /= weights.sum()
+    lengths = rng.poisson(mean_length, size)
+    tokens = words[rng.choice(vocabulary, size=lengths.sum(), p=weights)]
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [" ".join(tokens[start:end]) for start, end in zip(bounds[:-1], bounds[1:])], words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--alpha", type=float, default=0.5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = synthetic_corpus(rng, args.size)
+    texts, words = synthetic_texts(rng, args.size)
+    start = time.perf_counter()
+    builder = LexicalIndexBuilder()
+    for text in texts:
+        builder.add(text)
+    lexical = builder.build()
+    print(f"Built BM25 index over {args.size} chunks in {time.perf_counter() - start:.1f}s "
+          f"({lexical.nbytes / 2**20:.1f} MB)")
+
+    query_embs = normalize_rows(corpus[rng.integers(0, args.size, args.queries)]
+                                + 0.3 * rng.standard_normal((args.queries, DIM), dtype=np.float32))
+    # A few mid-frequency terms plus one common one, like "Fort Sumter" in a question
+    query_texts = [" ".join(words[rng.integers(100, 20_000, 3)]) + " " + words[rng.integers(0, 20)]
+                   for _ in range(args.queries)]
+
+    def dense(query, query_emb):
+        return rescored_top_k(corpus @ query_emb, corpus, query_emb, args.top_k)
+
+    def bm25(query, query_emb):
+        return lexical.search(query, args.candidates)
+
+    def hybrid(query, query_emb):
+        dense_rows, _ = rescored_top_k(corpus @ query_emb, corpus, query_emb, args.candidates)
+        lexical_rows, _ = lexical.search(query, args.candidates)
+        pool = np.union1d(dense_rows, lexical_rows)
+        cosine = corpus[pool].astype(np.float64) @ query_emb.astype(np.float64)
+        scores = lexical.score_rows(query, pool)
+        if scores.max() > 0:
+            scores = scores / scores.max()
+        fused = args.alpha * cosine + (1 - args.alpha) * scores
+        return pool[np.argsort(-fused, kind="stable")[:args.top_k]]
+
+    print(f"{'path':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, search in (("dense", dense), ("bm25", bm25), ("hybrid", hybrid)):
+        timings = []
+        for query, query_emb in zip(query_texts, query_embs):
+            start = time.perf_counter()
+            search(query, query_emb)
+            timings.append((time.perf_counter() - start) * 1000)
+        p50, p99 = percentiles(timings)
+        print(f"{name:>7} {p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Bytes transferred and latency of one-phase versus two-phase retrieval.
+
+One-phase reads every chunk with its text and keeps the top k. Two-phase
+reads ids and vectors only, scores them, then fetches text for the top k
+with one $in lookup. Documents are read as raw BSON so the byte counts are
+what the server actually sent. Needs MONGO_URI; run from the backend directory:
+    python -m benchmarks.bench_hydration --queries 20
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from benchmarks.bench_ann import percentiles
+from models.vector_store import normalize_rows, rescored_top_k
+
+VECTOR_PROJECTION = {"embedding": 1, "pdf_file": 1, "chunk_index": 1}
+FULL_PROJECTION = {**VECTOR_PROJECTION, "chunk_text": 1}
+
+
+def read_raw(collection, query, projection):
+    """Return the raw documents and the total bytes they took on the wire."""
+    docs = list(collection.find(query, projection))
+    return docs, sum(len(doc.raw) for doc in docs)
+
+
+def score(docs, query_emb, top_k):
+    embeddings = normalize_rows(np.array([doc["embedding"] for doc in docs], dtype=np.float32))
+    rows, _ = rescored_top_k(embeddings @ query_emb, embeddings, query_emb, top_k)
+    return rows
+
+
+def one_phase(collection, query_emb, top_k):
+    docs, nbytes = read_raw(collection, {}, FULL_PROJECTION)
+    texts = [docs[row]["chunk_text"] for row in score(docs, query_emb, top_k)]
+    return texts, nbytes
+
+
+def two_phase(collection, query_emb, top_k):
+    docs, nbytes = read_raw(collection, {}, VECTOR_PROJECTION)
+    winners = [docs[row]["_id"] for row in score(docs, query_emb, top_k)]
+    hydrated, text_bytes = read_raw(collection, {"_id": {"$in": winners}}, {"chunk_text": 1})
+    return [doc["chunk_text"] for doc in hydrated], nbytes + text_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--db", default="pdf_chunks_db")
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGO_URI"))
+    collection = client[args.db].get_collection(
+        "chunks", codec_options=CodecOptions(document_class=RawBSONDocument)
+    )
+    sample = collection.find_one({}, {"embedding": 1})
+    if sample is None:
+        print(f"No chunks in {args.db}.chunks")
+        return
+    dim = len(sample["embedding"])
+
+    rng = np.random.default_rng(0)
+    queries = normalize_rows(rng.standard_normal((args.queries, dim), dtype=np.float32))
+
+    print(f"{'path':>10} {'MB/query':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, run in (("one-phase", one_phase), ("two-phase", two_phase)):
+        timings, total_bytes = [], 0
+        for query_emb in queries:
+            start = time.perf_counter()
+            _, nbytes = run(collection, query_emb, args.top_k)
+            timings.append((time.perf_counter() - start) * 1000)
+            total_bytes += nbytes
+        p50, p99 = percentiles(timings)
+        print(f"{name:>10} {total_bytes / len(queries) / 2**20:>9.2f} {p50:>8.1f} {p99:>8.1f}")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
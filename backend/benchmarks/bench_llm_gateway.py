@@ -0,0 +1,103 @@
+"""
+Throughput of the LLM gateway against the local fake OpenAI server.
+
+Starts the fake server in-process, fires --requests chat completions through
+one gateway with --clients concurrent callers, and reports completed calls
+per second, p50/p99 call latency, retries and the peak number of requests
+the server saw in flight (never above --max-concurrency). Everything runs
+offline. Run from the backend directory:
+    python -m benchmarks.bench_llm_gateway --requests 200 --error-rate 0.05 --throttle-rate 0.05
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+import httpx
+
+from benchmarks.bench_ann import percentiles
+from benchmarks.fake_openai_server import create_app
+from models.llm_gateway import LLMGateway
+
+
+def start_server(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def run(gateway: LLMGateway, requests: int, clients: int, stream: bool):
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    timings, failures = [], 0
+
+    async def client():
+        nonlocal failures
+        while not queue.empty():
+            i = queue.get_nowait()
+            messages = [{"role": "user", "content": f"Summarize unit {i} of AP Biology"}]
+            start = time.perf_counter()
+            try:
+                if stream:
+                    async for _ in gateway.astream(messages, model="gpt-4", max_tokens=50):
+                        pass
+                else:
+                    await gateway.achat(messages, model="gpt-4", max_tokens=50)
+                timings.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return timings, failures, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=64, help="concurrent callers")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="gateway semaphore size")
+    parser.add_argument("--rpm", type=float, default=0, help="gateway requests-per-minute limit")
+    parser.add_argument("--tpm", type=float, default=0, help="gateway tokens-per-minute limit")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--server-rpm", type=float, default=0, help="requests-per-minute cap enforced by the server")
+    parser.add_argument("--stream", action="store_true")
+    args = parser.parse_args()
+
+    app = create_app(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 5, token_delay_ms=1.0,
+                     error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                     requests_per_minute=args.server_rpm, seed=0)
+    server, thread = start_server(app, args.port)
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+    gateway = LLMGateway(api_key="fake", base_url=base_url, max_concurrency=args.max_concurrency,
+                         requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+                         backoff_base=0.1, backoff_max=2.0, timeout=30.0)
+    try:
+        timings, failures, elapsed = asyncio.run(run(gateway, args.requests, args.clients, args.stream))
+        server_stats = httpx.get(f"http://127.0.0.1:{args.port}/stats").json()
+    finally:
+        gateway.close()
+        server.should_exit = True
+        thread.join()
+
+    p50, p99 = percentiles(timings) if timings else (0.0, 0.0)
+    stats = gateway.stats()
+    print(f"completed {len(timings)}/{args.requests} in {elapsed:.2f}s "
+          f"({len(timings) / elapsed:.1f} req/s), {failures} failed")
+    print(f"latency p50 {p50:.0f}ms p99 {p99:.0f}ms")
+    print(f"retries {stats['retries']}, throttled by the gateway for {stats['throttled_seconds']:.1f}s")
+    print(f"server: {server_stats['requests']} requests, {server_stats['errors']} 500s, "
+          f"{server_stats['throttled']} 429s, peak in flight {server_stats['peak_in_flight']}")
+
+
+if __name__ == "__main__":
+    main()
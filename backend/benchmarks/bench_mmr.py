@@ -0,0 +1,67 @@
+"""
+Latency of vectorized MMR selection over candidate pools of different sizes.
+
+For each pool size this reports p50/p99 latency of mmr_select and of a
+straightforward per-pair Python implementation, and checks that both pick
+the same chunks. Run from the backend directory:
+    python -m benchmarks.bench_mmr --pools 50 100 200 500
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_ann import DIM, percentiles, synthetic_corpus
+from models.vector_store import mmr_select, normalize_rows
+
+
+def mmr_loop(query_emb, candidates, top_k, diversity):
+    """Reference MMR with a Python loop over every (candidate, picked) pair."""
+    picks = []
+    remaining = list(range(len(candidates)))
+    while remaining and len(picks) < top_k:
+        best, best_score = None, -np.inf
+        for i in remaining:
+            redundancy = max((float(candidates[i] @ candidates[j]) for j in picks), default=0.0)
+            score = (1 - diversity) * float(candidates[i] @ query_emb) - diversity * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        picks.append(best)
+        remaining.remove(best)
+    return picks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pools", type=int, nargs="+", default=[50, 100, 200, 500])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--diversity", type=float, default=0.3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = synthetic_corpus(rng, 50_000)
+    print(f"{'pool':>5} {'numpy p50':>10} {'numpy p99':>10} {'loop p50':>9} {'loop p99':>9} {'agree':>6}")
+    for pool in args.pools:
+        vectorized, looped, agree = [], [], 0
+        for _ in range(args.queries):
+            query_emb = normalize_rows(rng.standard_normal((1, DIM), dtype=np.float32))[0]
+            candidates = np.ascontiguousarray(corpus[np.argsort(-(corpus @ query_emb))[:pool]])
+
+            start = time.perf_counter()
+            fast = mmr_select(query_emb, candidates, args.top_k, args.diversity)
+            vectorized.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            slow = mmr_loop(query_emb, candidates, args.top_k, args.diversity)
+            looped.append((time.perf_counter() - start) * 1000)
+            agree += fast.tolist() == slow
+
+        fast_p50, fast_p99 = percentiles(vectorized)
+        slow_p50, slow_p99 = percentiles(looped)
+        print(f"{pool:>5} {fast_p50:>10.3f} {fast_p99:>10.3f} {slow_p50:>9.2f} {slow_p99:>9.2f} "
+              f"{agree / args.queries:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Memory, latency and recall of the quantized first pass with float32 rescoring.
+
+For each corpus size and mode this reports the bytes held for the first pass,
+p50/p99 single-query latency (first pass plus rescoring) and recall@k against
+exact float32 search. Run from the backend directory:
+    python -m benchmarks.bench_quantization --sizes 100000 500000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_ann import DIM, percentiles, synthetic_corpus
+from models import quantization
+from models.vector_store import normalize_rows, rescored_top_k, top_k_indices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 500_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--oversample", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>9} {'mode':>7} {'MB':>8} {'p50 ms':>8} {'p99 ms':>8} {'recall@k':>9}")
+    for size in args.sizes:
+        corpus = synthetic_corpus(rng, size)
+        queries = normalize_rows(corpus[rng.integers(0, size, args.queries)]
+                                 + 0.3 * rng.standard_normal((args.queries, DIM), dtype=np.float32))
+        truth = [set(top_k_indices(corpus @ query, args.top_k).tolist()) for query in queries]
+
+        for mode in quantization.QUANTIZATION_MODES:
+            if mode == "none":
+                nbytes = corpus.nbytes
+                search = lambda q: top_k_indices(corpus @ q, args.top_k)
+            else:
+                codes = quantization.encode(corpus, mode)
+                nbytes = codes.nbytes
+                search = lambda q, codes=codes: rescored_top_k(
+                    codes.scores(q), corpus, q, args.top_k, shortlist_size=args.top_k * args.oversample
+                )[0]
+
+            timings, hits = [], 0
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                found = search(query)
+                timings.append((time.perf_counter() - start) * 1000)
+                hits += len(expected & set(found.tolist()))
+
+            p50, p99 = percentiles(timings)
+            recall = hits / (args.top_k * len(queries))
+            print(f"{size:>9} {mode:>7} {nbytes / 2**20:>8.1f} {p50:>8.2f} {p99:>8.2f} {recall:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare the old per-query cosine scoring against scoring pre-normalized vectors.
+
+Run from the backend directory:
+    python -m benchmarks.bench_scoring --sizes 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from models.vector_store import normalize_rows, top_k_indices
+
+DIM = 384
+
+
+def old_scoring(embeddings, query_emb, top_k):
+    similarities = np.dot(embeddings, query_emb) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_emb)
+    )
+    return np.argsort(similarities)[-top_k:][::-1]
+
+
+def new_scoring(embeddings, query_emb, top_k):
+    return top_k_indices(embeddings @ query_emb, top_k)
+
+
+def time_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>10} {'old ms':>10} {'new ms':>10} {'speedup':>8}")
+    for size in args.sizes:
+        raw = rng.standard_normal((size, DIM), dtype=np.float32)
+        query = rng.standard_normal(DIM, dtype=np.float32)
+        unit = normalize_rows(raw.copy())
+        unit_query = query / np.linalg.norm(query)
+
+        # Same winners either way; only the cost differs
+        assert set(old_scoring(raw, query, args.top_k)) == set(new_scoring(unit, unit_query, args.top_k))
+
+        old_ms = time_ms(lambda: old_scoring(raw, query, args.top_k), args.repeats)
+        new_ms = time_ms(lambda: new_scoring(unit, unit_query, args.top_k), args.repeats)
+        print(f"{size:>10} {old_ms:>10.2f} {new_ms:>10.2f} {old_ms / new_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Per-query scoring work with and without course sharding.
+
+Splits a synthetic corpus into --courses equal course shards and reports
+rows scored and p50/p99 single-query latency for an exact search of the
+whole corpus against an exact search of one shard. Run from the backend
+directory:
+    python -m benchmarks.bench_shards --size 200000 --courses 29
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_ann import DIM, percentiles, synthetic_corpus
+from models.vector_store import normalize_rows, rescored_top_k
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--courses", type=int, default=29)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = synthetic_corpus(rng, args.size)
+    bounds = np.linspace(0, args.size, args.courses + 1, dtype=int)
+    shards = [corpus[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    targets = rng.integers(0, args.courses, args.queries)
+    queries = normalize_rows(corpus[rng.integers(0, args.size, args.queries)]
+                             + 0.3 * rng.standard_normal((args.queries, DIM), dtype=np.float32))
+
+    print(f"{'search':>8} {'rows/query':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, pick in (("all", lambda course: corpus), ("shard", lambda course: shards[course])):
+        timings, rows = [], 0
+        for query, course in zip(queries, targets):
+            embeddings = pick(course)
+            start = time.perf_counter()
+            rescored_top_k(embeddings @ query, embeddings, query, args.top_k)
+            timings.append((time.perf_counter() - start) * 1000)
+            rows += len(embeddings)
+        p50, p99 = percentiles(timings)
+        print(f"{name:>8} {rows / args.queries:>11.0f} {p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
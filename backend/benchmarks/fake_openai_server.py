@@ -0,0 +1,152 @@
+"""
+Local stand-in for the OpenAI chat completions API, for exercising the
+LLM gateway offline.
+
+Answers POST /v1/chat/completions, streamed or not, after a configurable
+latency, and injects 500s and 429s (with Retry-After) at configurable
+rates. --slow-rate makes a share of requests take --slow-ms longer, like
+the real API's occasional very slow completions. --rpm makes it reject
+requests above a requests-per-minute limit the way the real API does.
+GET /stats reports what it has seen, including the peak number of
+requests in flight. Run from the backend directory:
+    python -m benchmarks.fake_openai_server --port 8001 --latency-ms 800 --error-rate 0.05
+and point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:8001/v1.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(latency_ms: float = 500.0, jitter_ms: float = 100.0, token_delay_ms: float = 10.0,
+               error_rate: float = 0.0, throttle_rate: float = 0.0, requests_per_minute: float = 0,
+               completion_tokens: int = 100, seed: int = None, slow_rate: float = 0.0,
+               slow_ms: float = 5000.0) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+    # Requests left this minute; refills continuously, like the real limits
+    bucket = {"level": float(requests_per_minute), "updated": time.monotonic()}
+    stats = {"requests": 0, "completed": 0, "errors": 0, "throttled": 0, "slow": 0, "in_flight": 0,
+             "peak_in_flight": 0}
+
+    def error(status: int, message: str, kind: str, headers: dict = None):
+        body = {"error": {"message": message, "type": kind, "code": None}}
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    def answer_words(body: dict):
+        prompt = next((m["content"] for m in reversed(body["messages"]) if m["role"] == "user"), "")
+        count = min(body.get("max_tokens") or completion_tokens, completion_tokens)
+        words = f"Fake answer to: {prompt[:80]}".split()
+        return (words + ["lorem"] * count)[:max(count, 1)], sum(len(m["content"].split()) for m in body["messages"])
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "gpt-4", "object": "model", "owned_by": "fake"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if requests_per_minute:
+            now = time.monotonic()
+            bucket["level"] = min(requests_per_minute,
+                                  bucket["level"] + (now - bucket["updated"]) * requests_per_minute / 60.0)
+            bucket["updated"] = now
+            if bucket["level"] < 1:
+                stats["throttled"] += 1
+                retry_after = (1 - bucket["level"]) * 60.0 / requests_per_minute
+                return error(429, "Rate limit reached for requests", "requests",
+                             {"retry-after": f"{retry_after:.2f}"})
+            bucket["level"] -= 1
+        if rng.random() < throttle_rate:
+            stats["throttled"] += 1
+            return error(429, "Rate limit reached for tokens", "tokens", {"retry-after": "0.5"})
+
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        # A streamed answer leaves the in-flight count when its last event is sent
+        streaming = False
+        try:
+            delay_ms = max(0.0, rng.gauss(latency_ms, jitter_ms))
+            if rng.random() < slow_rate:
+                stats["slow"] += 1
+                delay_ms += slow_ms
+            await asyncio.sleep(delay_ms / 1000.0)
+            if rng.random() < error_rate:
+                stats["errors"] += 1
+                return error(500, "The server had an error while processing your request", "server_error")
+
+            words, prompt_tokens = answer_words(body)
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+            created = int(time.time())
+            model = body.get("model", "gpt-4")
+            if not body.get("stream"):
+                stats["completed"] += 1
+                return {
+                    "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                              "total_tokens": prompt_tokens + len(words)}
+                }
+
+            def chunk(delta: dict, finish_reason: str = None) -> str:
+                event = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                }
+                return f"data: {json.dumps(event)}\n\n"
+
+            async def events():
+                try:
+                    for i, word in enumerate(words):
+                        yield chunk({"content": word if i == 0 else " " + word})
+                        await asyncio.sleep(token_delay_ms / 1000.0)
+                    yield chunk({}, "stop")
+                    yield "data: [DONE]\n\n"
+                    stats["completed"] += 1
+                finally:
+                    stats["in_flight"] -= 1
+
+            streaming = True
+            return StreamingResponse(events(), media_type="text/event-stream")
+        finally:
+            if not streaming:
+                stats["in_flight"] -= 1
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--token-delay-ms", type=float, default=10.0, help="delay between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--rpm", type=float, default=0, help="reject requests above this many per minute")
+    parser.add_argument("--completion-tokens", type=int, default=100)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests that take --slow-ms longer")
+    parser.add_argument("--slow-ms", type=float, default=5000.0)
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.jitter_ms, args.token_delay_ms, args.error_rate, args.throttle_rate,
+                     args.rpm, args.completion_tokens, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Concurrent load test for the RAG endpoints.
+
+Fires requests at a running backend with increasing concurrency and reports
+throughput and latency percentiles at each level, which shows whether
+requests overlap or queue behind each other. Start the backend first, then
+run from the backend directory:
+    python -m benchmarks.load_test --url http://localhost:8000/test-rag --levels 1 4 16
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+import numpy as np
+
+PROMPTS = [
+    "APUSH study guide",
+    "AP Bio unit 3",
+    "Explain the causes of the Civil War",
+    "Summarize photosynthesis for AP Biology",
+    "Key Supreme Court cases for AP Gov",
+]
+
+
+async def run_level(client, url, concurrency, requests_per_worker, payload_key):
+    latencies, errors = [], 0
+
+    async def worker(worker_id):
+        nonlocal errors
+        for i in range(requests_per_worker):
+            prompt = PROMPTS[(worker_id + i) % len(PROMPTS)]
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json={payload_key: prompt, "email": "loadtest@example.com"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000/test-rag")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests-per-worker", type=int, default=5)
+    parser.add_argument("--payload-key", default="user_prompt")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=max(args.levels))
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        print(f"{'conc':>5} {'ok':>5} {'err':>4} {'req/s':>8} {'p50 s':>7} {'p99 s':>7}")
+        for level in args.levels:
+            latencies, errors, elapsed = await run_level(
+                client, args.url, level, args.requests_per_worker, args.payload_key
+            )
+            p50, p99 = (np.percentile(latencies, [50, 99]) if latencies else (0.0, 0.0))
+            print(f"{level:>5} {len(latencies):>5} {errors:>4} {len(latencies) / elapsed:>8.2f} {p50:>7.2f} {p99:>7.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+import glob
+import json
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # only needed for the approximate backends
+    faiss = None
+
+INDEX_KINDS = ("exact", "hnsw", "ivf")
+DEFAULT_INDEX_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexes", "chunks.index"
+)
+# Course shards smaller than this are cheap enough to search exactly
+MIN_SHARD_INDEX_SIZE = 1000
+
+
+class AnnIndex:
+    """
+    Approximate nearest-neighbour index over unit-length chunk embeddings.
+
+    Wraps a FAISS inner-product index (HNSW or IVF) together with the chunk
+    ids of its rows. Both are persisted side by side: the FAISS index at
+    `path` and a JSON sidecar with the kind and ids at `path + ".json"`.
+    """
+
+    def __init__(self, index, ids: Sequence[str], kind: str):
+        self.index = index
+        self.ids = [str(i) for i in ids]
+        self.id_set = set(self.ids)
+        self.kind = kind
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, ids: Sequence, kind: str = "hnsw",
+              hnsw_m: int = 32, ef_construction: int = 200, ef_search: int = 64,
+              nlist: int = None, nprobe: int = 16) -> "AnnIndex":
+        """Build an index of the given kind over float32 unit-length rows."""
+        _require_faiss()
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        dim = embeddings.shape[1]
+        if kind == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = ef_construction
+            index.hnsw.efSearch = ef_search
+        elif kind == "ivf":
+            nlist = nlist or max(1, int(4 * np.sqrt(len(embeddings))))
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+            index.nprobe = nprobe
+        else:
+            raise ValueError(f"Unknown ANN index kind '{kind}', expected 'hnsw' or 'ivf'")
+        index.add(embeddings)
+        return cls(index, ids, kind)
+
+    def save(self, path: str = DEFAULT_INDEX_PATH):
+        """Write the index and its id sidecar, replacing any previous files."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        faiss.write_index(self.index, path + ".tmp")
+        with open(path + ".json.tmp", "w") as f:
+            json.dump({"kind": self.kind, "ids": self.ids}, f)
+        os.replace(path + ".tmp", path)
+        os.replace(path + ".json.tmp", path + ".json")
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_INDEX_PATH) -> "AnnIndex":
+        """Load an index previously written by save()."""
+        _require_faiss()
+        with open(path + ".json") as f:
+            sidecar = json.load(f)
+        return cls(faiss.read_index(path), sidecar["ids"], sidecar["kind"])
+
+    def set_search_params(self, ef_search: int = None, nprobe: int = None):
+        """Adjust the recall/latency trade-off of an already built index."""
+        if ef_search is not None and self.kind == "hnsw":
+            self.index.hnsw.efSearch = ef_search
+        if nprobe is not None and self.kind == "ivf":
+            self.index.nprobe = nprobe
+
+    def search(self, query_embs: np.ndarray, top_k: int) -> List[List[Tuple[str, float]]]:
+        """Return the (chunk id, score) pairs of the top_k neighbours of each query."""
+        query_embs = np.ascontiguousarray(query_embs, dtype=np.float32)
+        scores, positions = self.index.search(query_embs, top_k)
+        return [
+            [(self.ids[pos], float(score)) for pos, score in zip(row_pos, row_scores) if pos >= 0]
+            for row_pos, row_scores in zip(positions, scores)
+        ]
+
+
+def shard_index_path(index_path: str, course: str) -> str:
+    """Path of one course shard's index next to the full index, e.g. chunks.biology.index."""
+    root, ext = os.path.splitext(index_path)
+    return f"{root}.{course}{ext}"
+
+
+def load_shard_indexes(index_path: str = DEFAULT_INDEX_PATH) -> Dict[str, AnnIndex]:
+    """Load every course shard index saved next to index_path, keyed by course."""
+    root, ext = os.path.splitext(index_path)
+    shards = {}
+    for path in glob.glob(f"{glob.escape(root)}.*{ext}"):
+        shards[path[len(root) + 1:-len(ext)]] = AnnIndex.load(path)
+    return shards
+
+
+def _require_faiss():
+    if faiss is None:
+        raise ImportError("The hnsw and ivf index backends need faiss: pip install faiss-cpu")
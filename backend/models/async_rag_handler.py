@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .metrics import METRICS
+from .query_cache import EmbeddingCache
+from .rag_handler import LLM_PARAMS, RAGHandler
+from .single_flight import SingleFlight
+from .working_set import chunk_key
+
+logger = logging.getLogger(__name__)
+
+
+def generation_key(query: str, request: Dict) -> Hashable:
+    """Requests share an LLM call when their prompts normalize alike and they retrieved the same chunks."""
+    return EmbeddingCache.normalize(query), request["chunk_keys"], request.get("prompt")
+
+
+class AsyncRAGHandler:
+    """
+    Event-loop friendly front end to a RAGHandler.
+
+    Retrieval (query encoding and scoring against the resident store) runs
+    on a bounded thread pool, and the LLM call goes through the gateway's
+    async client, so a slow completion never blocks other requests. The model,
+    vector store, caches and LLM gateway are shared with the wrapped
+    RAGHandler.
+
+    Identical requests in flight at the same time are coalesced
+    (RAG_SINGLE_FLIGHT): the same normalized prompt and course share one
+    retrieval, and requests whose key_fn(query, request) matches, by default
+    the normalized prompt plus the retrieved chunk ids, share one LLM call
+    or stream.
+    """
+
+    def __init__(self, rag_handler: RAGHandler, max_workers: int = None,
+                 key_fn: Callable[[str, Dict], Hashable] = generation_key):
+        self.rag = rag_handler
+        self.key_fn = key_fn
+        coalesce = os.getenv("RAG_SINGLE_FLIGHT", "1") == "1"
+        self.preparations = SingleFlight("preparation", enabled=coalesce)
+        self.generations = SingleFlight("generation", enabled=coalesce)
+        self.streams = SingleFlight("stream", enabled=coalesce)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv("RAG_ENCODE_WORKERS", "4")),
+            thread_name_prefix="rag-encode"
+        )
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def retrieve_relevant_chunks(self, query: str, top_k: int = 5, similarity_threshold: float = 0.3,
+                                       course: Optional[str] = None, diversity: Optional[float] = None) -> List[Dict]:
+        """Async retrieve_relevant_chunks; encoding and scoring run on the pool."""
+        return await self._run(self.rag.retrieve_relevant_chunks, query, top_k, similarity_threshold, course, diversity)
+
+    async def retrieve_many(self, queries: List[str], top_k: int = 5, similarity_threshold: float = 0.3,
+                            course: Optional[str] = None, diversity: Optional[float] = None) -> List[List[Dict]]:
+        """Async retrieve_many; encoding and scoring run on the pool."""
+        return await self._run(self.rag.retrieve_many, queries, top_k, similarity_threshold, course, diversity)
+
+    def _prepare(self, query: str, course: Optional[str], working_set: Optional[List[Dict]] = None,
+                 prompt: Optional[str] = None):
+        """prepare_generation on the pool, shared by identical prompts arriving together."""
+        key = (EmbeddingCache.normalize(query), course,
+               tuple(chunk_key(entry) for entry in working_set) if working_set else None, prompt)
+        return self.preparations.do(
+            key, lambda: self._run(self.rag.prepare_generation, query, course, working_set, prompt)
+        )
+
+    async def _complete(self, request: Dict, llm=None, llm_params: Optional[Dict] = None) -> str:
+        try:
+            logger.debug("Making async API call to OpenAI...")
+            started = time.perf_counter()
+            llm = llm or self.rag.hedged_llm
+            with METRICS.stage("llm"):
+                completion = await llm.achat(request["messages"], **(llm_params or LLM_PARAMS))
+            answer = completion.choices[0].message.content.strip()
+            return self.rag.finish_generation(request, answer, time.perf_counter() - started)
+        except Exception as api_error:
+            logger.error("OpenAI API error: %s", api_error)
+            return f"I encountered an error while generating the response: {str(api_error)}"
+
+    async def generate_response_with_context(self, query: str, course: Optional[str] = None) -> str:
+        """Async generate_response_with_context with a non-blocking LLM call."""
+        response, _ = await self.generate_with_working_set(query, course)
+        return response
+
+    async def generate_with_working_set(self, query: str, course: Optional[str] = None,
+                                        working_set: Optional[List[Dict]] = None,
+                                        prompt: Optional[str] = None, llm=None,
+                                        llm_params: Optional[Dict] = None) -> Tuple[str, List[Dict]]:
+        """
+        Answer a question in a study guide, retrieving from the guide's
+        working set first (RAGHandler.retrieve_follow_up). prompt, when
+        given, is what the model sees instead of query (see
+        RAGHandler.prepare_generation). llm and llm_params replace the
+        handler's hedged gateway and LLM_PARAMS for the completion. Returns
+        the response and the updated working set to store on the guide.
+        """
+        working_set = working_set or []
+        try:
+            response, request = await self._prepare(query, course, working_set, prompt)
+            if request is not None:
+                working_set = request["working_set"]
+            if response is not None:
+                return response, working_set
+            answer = await self.generations.do(
+                self.key_fn(query, request), lambda: self._complete(request, llm, llm_params)
+            )
+            return answer, working_set
+        except Exception as e:
+            logger.exception("Error in generate_with_working_set")
+            return f"An unexpected error occurred: {str(e)}", working_set
+
+    async def _stream_answer(self, request: Dict) -> AsyncIterator[Dict]:
+        """Token events for one completion, then "done" with the full answer or "error"."""
+        parts, first_token = [], False
+        try:
+            llm_started = time.perf_counter()
+            async for event in self.rag.hedged_llm.astream(request["messages"], **LLM_PARAMS):
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if delta:
+                    if not first_token:
+                        first_token = True
+                        METRICS.observe("rag_stage_seconds", time.perf_counter() - llm_started, stage="llm_first_token")
+                    parts.append(delta)
+                    yield {"type": "token", "content": delta}
+        except Exception as api_error:
+            logger.error("OpenAI API error: %s", api_error)
+            yield {"type": "error", "detail": f"I encountered an error while generating the response: {str(api_error)}"}
+            return
+
+        METRICS.observe("rag_stage_seconds", time.perf_counter() - llm_started, stage="llm")
+        answer = self.rag.finish_generation(request, "".join(parts).strip(), time.perf_counter() - llm_started)
+        yield {"type": "done", "response": answer}
+
+    async def stream_response_with_context(self, query: str, course: Optional[str] = None,
+                                           working_set: Optional[List[Dict]] = None) -> AsyncIterator[Dict]:
+        """
+        Stream a RAG answer as events.
+
+        Yields one "metadata" event describing the retrieved chunks as soon as
+        retrieval finishes, "token" events as the completion arrives, and a
+        final "done" event with the full response and the time to first token
+        in seconds. An "error" event replaces "done" if the LLM call fails.
+        A request identical to one already streaming joins that stream and
+        is sent its tokens so far first. With a study guide's working_set,
+        retrieval starts from it and "done" also carries the updated
+        "working_set".
+        """
+        started = time.perf_counter()
+        response, request = await self._prepare(query, course, working_set)
+        chunks = request["chunks"] if request else []
+        working_set = request["working_set"] if request else working_set or []
+        yield {
+            "type": "metadata",
+            "chunks": [
+                {"pdf_file": chunk["pdf_file"], "chunk_index": chunk["chunk_index"], "score": chunk["score"]}
+                for chunk in chunks
+            ]
+        }
+
+        if response is not None:
+            yield {"type": "token", "content": response}
+            yield {"type": "done", "response": response, "time_to_first_token": time.perf_counter() - started,
+                   "working_set": working_set}
+            return
+
+        time_to_first_token = None
+        stream = self.streams.stream(self.key_fn(query, request), lambda: self._stream_answer(request))
+        async for event in stream:
+            if event["type"] == "token" and time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - started
+                logger.debug("Time to first token: %.3fs", time_to_first_token)
+            if event["type"] == "done":
+                event = {**event, "time_to_first_token": time_to_first_token, "working_set": working_set}
+            yield event
+
+    def coalescing_stats(self) -> Dict:
+        return {
+            "preparation": self.preparations.stats(),
+            "generation": self.generations.stats(),
+            "stream": self.streams.stats()
+        }
+
+    async def close(self):
+        """Close the gateway's async HTTP pool and stop the worker pool."""
+        await self.rag.llm.aclose()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List
+
+import numpy as np
+
+
+class BatchingEncoder:
+    """
+    Shared query encoder that coalesces concurrent encode calls.
+
+    Callers block in encode() while a single worker thread collects every
+    request that arrives within max_wait_ms of the first one, up to
+    max_batch_size texts, runs them through the model as one batch and
+    hands each caller its own rows.
+    """
+
+    def __init__(self, model, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.encoded = 0
+        self.largest_batch = 0
+        self.batch_size_counts = {}
+        self._queue = queue.Queue()
+        # Request taken off the queue that leads the next batch
+        self._carry = None
+        # Held while checking _stop and queueing, so nothing is queued behind close()'s sentinel
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="batch-encoder", daemon=True)
+        self._worker.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts to unit-length float32 vectors, batched with concurrent callers."""
+        future = Future()
+        with self._lock:
+            if self._stop.is_set():
+                raise RuntimeError("BatchingEncoder is closed")
+            self._queue.put((list(texts), future))
+        return future.result()
+
+    def _collect(self):
+        """The next batch of (texts, future) requests, or [] once close() has been reached."""
+        if self._carry is not None:
+            (texts, future), self._carry = self._carry, None
+        else:
+            texts, future = self._queue.get()
+        if future is None:
+            return []
+        pending, size = [(texts, future)], len(texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                texts, future = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if future is None or size + len(texts) > self.max_batch_size:
+                # Too big for this batch, or close(): it leads the next one
+                self._carry = (texts, future)
+                break
+            pending.append((texts, future))
+            size += len(texts)
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            if not pending:
+                break
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            try:
+                vectors = self.model.encode(texts, normalize_embeddings=True).astype(np.float32)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self._record(len(texts))
+            start = 0
+            for request_texts, future in pending:
+                future.set_result(vectors[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def _record(self, batch_size: int):
+        self.batches += 1
+        self.encoded += batch_size
+        self.largest_batch = max(self.largest_batch, batch_size)
+        self.batch_size_counts[batch_size] = self.batch_size_counts.get(batch_size, 0) + 1
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "mean_batch_size": self.encoded / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0
+        }
+
+    def close(self):
+        """Stop the worker once the requests already queued have been served; later encode() calls fail."""
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._stop.set()
+            self._queue.put((None, None))
+        self._worker.join(timeout=5)
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "llm_cache"
+)
+MODES = ("read_only", "read_write")
+# Request fields that do not change what the model returns
+_IGNORED_PARAMS = frozenset({"stream", "store", "user", "timeout", "extra_headers", "metadata"})
+
+
+class CompletionCache:
+    """
+    Persistent, content-addressed cache of chat completions.
+
+    A completion is stored as JSON under the SHA-256 of the canonical JSON
+    of its request (model, messages and sampling parameters), so any
+    process asking the exact same question gets the stored answer.
+    "read_write" serves hits and writes every new completion through to
+    disk; "read_only" serves hits but never writes, for runs that must not
+    change the cache. Once the files exceed max_bytes, the least recently
+    used entries are deleted.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = 256 * 2**20, mode: str = "read_write"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {MODES}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # path -> (size, last use); rebuilt from the directory so other runs' entries count
+        self._entries = {}
+        self._bytes = 0
+        if os.path.isdir(directory):
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if name.endswith(".json"):
+                        stat = os.stat(os.path.join(root, name))
+                        self._entries[os.path.join(root, name)] = (stat.st_size, stat.st_mtime)
+                        self._bytes += stat.st_size
+
+    @staticmethod
+    def key(request: Dict) -> str:
+        """SHA-256 of the request's model, messages and sampling parameters."""
+        canonical = {name: value for name, value in request.items() if name not in _IGNORED_PARAMS}
+        encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        # Two-character fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                completion = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            self.hits += 1
+            entry = self._entries.get(path)
+            if entry is None:
+                # Written by another process since this one scanned the directory
+                entry = (os.path.getsize(path), now)
+                self._bytes += entry[0]
+            self._entries[path] = (entry[0], now)
+        try:
+            # Recency survives restarts through the file's mtime
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return completion
+
+    def put(self, key: str, completion: Dict):
+        if self.mode != "read_write":
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a concurrent reader never sees half a file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(completion, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            previous = self._entries.get(path)
+            self._bytes += size - (previous[0] if previous else 0)
+            self._entries[path] = (size, time.time())
+            self.writes += 1
+            self._evict()
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        for path, (size, _) in sorted(self._entries.items(), key=lambda entry: entry[1][1]):
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            del self._entries[path]
+            self._bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "directory": self.directory,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions
+        }
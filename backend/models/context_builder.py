@@ -0,0 +1,149 @@
+import re
+import threading
+from typing import Dict, List, Tuple
+
+import tiktoken
+
+# Sentences shorter than this are too generic ("See Figure 1.") to count as duplicates
+_MIN_DUPLICATE_CHARS = 40
+_SENTENCE_END = re.compile(r"(?<=[.!?])(\s+)")
+
+
+def _overlap(first: str, second: str, max_overlap: int) -> int:
+    """Length of the longest suffix of first that is also a prefix of second."""
+    probe = second[:32]
+    if not probe:
+        return 0
+    start = first.find(probe, max(0, len(first) - max_overlap))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(probe, start + 1)
+    return 0
+
+
+class ContextBuilder:
+    """
+    Packs retrieved chunks into the prompt context under a token budget.
+
+    Chunks from the same PDF with consecutive chunk_index values are merged
+    and the text they share at the boundary (the chunker's overlap) is kept
+    once. Sentences already present in an earlier segment are dropped.
+    Segments are then added best score first, counted with the model's own
+    tokenizer, and the last one that does not fit is truncated to the
+    remaining budget.
+    """
+
+    def __init__(self, token_budget: int = 2000, model: str = "gpt-4", max_overlap: int = 400,
+                 min_segment_tokens: int = 50):
+        self.token_budget = token_budget
+        self.max_overlap = max_overlap
+        self.min_segment_tokens = min_segment_tokens
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.builds = 0
+        self.naive_tokens = 0
+        self.context_tokens = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def _merge(self, chunks: List[Dict]) -> List[Tuple[float, str, str]]:
+        """(best score, pdf_file, text) per run of adjacent chunks, best first."""
+        by_pdf = {}
+        for chunk in chunks:
+            by_pdf.setdefault(chunk["pdf_file"], []).append(chunk)
+
+        segments = []
+        for pdf_file, pdf_chunks in by_pdf.items():
+            pdf_chunks.sort(key=lambda chunk: chunk["chunk_index"])
+            text, score, last_index = None, 0.0, None
+            for chunk in pdf_chunks:
+                if text is not None and chunk["chunk_index"] == last_index + 1:
+                    shared = _overlap(text, chunk["chunk_text"], self.max_overlap)
+                    # Chunks cut at a sentence end follow on without overlap
+                    text += chunk["chunk_text"][shared:] if shared else " " + chunk["chunk_text"]
+                    score = max(score, chunk.get("score", 0.0))
+                else:
+                    if text is not None:
+                        segments.append((score, pdf_file, text))
+                    text, score = chunk["chunk_text"], chunk.get("score", 0.0)
+                last_index = chunk["chunk_index"]
+            segments.append((score, pdf_file, text))
+        segments.sort(key=lambda segment: segment[0], reverse=True)
+        return segments
+
+    @staticmethod
+    def _drop_repeated_sentences(segments: List[Tuple[float, str, str]]) -> List[Tuple[float, str, str]]:
+        seen, deduplicated = set(), []
+        for score, pdf_file, text in segments:
+            kept = []
+            # split() alternates sentences and the whitespace after them
+            pieces = _SENTENCE_END.split(text)
+            for sentence, space in zip(pieces[0::2], pieces[1::2] + [""]):
+                key = " ".join(sentence.lower().split())
+                if len(key) >= _MIN_DUPLICATE_CHARS:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                kept.append(sentence + space)
+            text = "".join(kept).strip()
+            if text:
+                deduplicated.append((score, pdf_file, text))
+        return deduplicated
+
+    def build(self, chunks: List[Dict]) -> Tuple[str, Dict]:
+        """
+        Return (context, stats) for chunks with pdf_file, chunk_index,
+        chunk_text and score. stats compares the packed context's token
+        count with plain concatenation of every chunk.
+        """
+        naive = "\n\n".join(f"Chunk {i+1}: {chunk['chunk_text']}" for i, chunk in enumerate(chunks))
+        naive_tokens = self.count_tokens(naive)
+
+        parts, used, truncated = [], 0, False
+        segments = self._drop_repeated_sentences(self._merge(chunks))
+        for score, pdf_file, text in segments:
+            part = f"Chunk {len(parts) + 1}: {text}"
+            tokens = self.encoding.encode(part)
+            # Separator between parts
+            cost = len(tokens) + (2 if parts else 0)
+            if used + cost > self.token_budget:
+                remaining = self.token_budget - used - (2 if parts else 0)
+                if remaining >= self.min_segment_tokens:
+                    parts.append(self.encoding.decode(tokens[:remaining]))
+                    used = self.token_budget
+                truncated = True
+                break
+            parts.append(part)
+            used += cost
+
+        context = "\n\n".join(parts)
+        stats = {
+            "chunks": len(chunks),
+            "segments": len(parts),
+            "naive_tokens": naive_tokens,
+            "context_tokens": self.count_tokens(context),
+            "truncated": truncated
+        }
+        with self._lock:
+            self.builds += 1
+            self.naive_tokens += stats["naive_tokens"]
+            self.context_tokens += stats["context_tokens"]
+            self.truncated += truncated
+        return context, stats
+
+    def stats(self) -> Dict:
+        return {
+            "builds": self.builds,
+            "token_budget": self.token_budget,
+            "naive_tokens": self.naive_tokens,
+            "context_tokens": self.context_tokens,
+            "tokens_saved": self.naive_tokens - self.context_tokens,
+            "reduction": 1 - self.context_tokens / self.naive_tokens if self.naive_tokens else 0.0,
+            "truncated": self.truncated
+        }
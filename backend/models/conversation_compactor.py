@@ -0,0 +1,150 @@
+import logging
+from typing import Dict, List
+
+import tiktoken
+
+from .llm_gateway import LLMGateway
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a tutoring conversation about an AP study guide. "
+    "Update the summary with the new turns. Keep the topics covered, the facts and definitions "
+    "given, and the student's open questions and preferences. Drop pleasantries. "
+    "Reply with the updated summary only."
+)
+
+
+class ConversationCompactor:
+    """
+    Keeps follow-up prompts for a study guide within a fixed token budget.
+
+    Each guide carries a rolling summary, {"text", "turns"}, covering its
+    first `turns` conversation turns. A prompt is built from the summary
+    plus the turns after it, kept verbatim newest first for as long as they
+    fit the budget. After each follow-up, refresh() folds every turn older
+    than the last recent_turns into the summary with one LLM call per batch.
+    It runs in the background, so no request waits for it.
+    """
+
+    def __init__(self, collection, llm: LLMGateway, model: str = "gpt-4o-mini", recent_turns: int = 4,
+                 token_budget: int = 3000, summary_tokens: int = 400, turn_tokens: int = 1000):
+        self.collection = collection
+        self.llm = llm
+        self.model = model
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        # Longest any single turn may be in a prompt or a summarization batch
+        self.turn_tokens = turn_tokens
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        self._refreshing = set()
+        self.refreshes = 0
+        self.summarized_turns = 0
+
+    def _truncate(self, text: str, tokens: int) -> str:
+        encoded = self.encoding.encode(text)
+        return text if len(encoded) <= tokens else self.encoding.decode(encoded[:tokens]) + " ..."
+
+    def _format_turn(self, turn: Dict) -> str:
+        return (f"User: {self._truncate(turn['user_prompt'], self.turn_tokens // 2)}\n"
+                f"AI: {self._truncate(turn['response'], self.turn_tokens)}")
+
+    def build_prompt(self, guide: Dict, user_prompt: str) -> str:
+        """The follow-up prompt for guide: summary, as many recent turns as fit, then the new question."""
+        conversation = guide.get("conversation", [])
+        summary = guide.get("summary") or {}
+        question = f"User: {self._truncate(user_prompt, self.turn_tokens)}\nAI:"
+        parts = []
+        if summary.get("text"):
+            parts.append(f"Summary of the earlier conversation:\n{self._truncate(summary['text'], self.summary_tokens)}")
+        used = sum(len(self.encoding.encode(part)) for part in parts + [question])
+
+        recent = []
+        for turn in reversed(conversation[summary.get("turns", 0):]):
+            text = self._format_turn(turn)
+            cost = len(self.encoding.encode(text))
+            if used + cost > self.token_budget:
+                # Older turns wait for the next summary refresh
+                break
+            recent.append(text)
+            used += cost
+        return "\n".join(parts + recent[::-1] + [question])
+
+    def _batches(self, turns: List[Dict]) -> List[List[Dict]]:
+        """Split turns into runs that each fit one summarization call."""
+        batches, batch, used = [], [], 0
+        for turn in turns:
+            cost = len(self.encoding.encode(self._format_turn(turn)))
+            if batch and used + cost > self.token_budget:
+                batches.append(batch)
+                batch, used = [], 0
+            batch.append(turn)
+            used += cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _summarize(self, summary: str, turns: List[Dict]) -> str:
+        transcript = "\n".join(self._format_turn(turn) for turn in turns)
+        completion = await self.llm.achat(
+            [
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"}
+            ],
+            model=self.model,
+            max_tokens=self.summary_tokens,
+            temperature=0.0
+        )
+        return completion.choices[0].message.content.strip()
+
+    async def refresh(self, email: str, study_guide_id: str):
+        """Fold turns older than the recent window into the guide's stored summary."""
+        key = (email, study_guide_id)
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        try:
+            user = await self.collection.find_one(
+                {"email": email, "study_guides._id": study_guide_id},
+                {"study_guides.$": 1}
+            )
+            if not user:
+                return
+            guide = user["study_guides"][0]
+            conversation = guide.get("conversation", [])
+            summary = guide.get("summary") or {"text": "", "turns": 0}
+            # Shorter than the recent window: nothing is stale, and a negative end would wrap
+            stale = conversation[summary["turns"]:max(summary["turns"], len(conversation) - self.recent_turns)]
+            for batch in self._batches(stale):
+                text = await self._summarize(summary["text"], batch)
+                updated = {"text": text, "turns": summary["turns"] + len(batch)}
+                # Only replace the summary this refresh started from, in case another worker got there first
+                result = await self.collection.update_one(
+                    {"email": email, "study_guides": {"$elemMatch": {
+                        "_id": study_guide_id,
+                        "summary.turns": summary["turns"] if guide.get("summary") else None
+                    }}},
+                    {"$set": {"study_guides.$.summary": updated}}
+                )
+                if result.modified_count == 0:
+                    return
+                guide["summary"], summary = updated, updated
+                self.summarized_turns += len(batch)
+            self.refreshes += 1
+        except Exception as e:
+            logger.warning("Summary refresh failed for guide %s: %s", study_guide_id, e)
+        finally:
+            self._refreshing.discard(key)
+
+    def stats(self) -> Dict:
+        return {
+            "recent_turns": self.recent_turns,
+            "token_budget": self.token_budget,
+            "refreshes": self.refreshes,
+            "summarized_turns": self.summarized_turns,
+            "refreshing": len(self._refreshing)
+        }
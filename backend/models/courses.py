@@ -0,0 +1,134 @@
+import re
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+# Course ids are the College Board course slugs from scraper/input_websites.csv
+# without the "ap-" prefix. Aliases are matched as whole words against prompts
+# and PDF file names after both are lowercased and reduced to words. A bare
+# word that also names a history topic or has an everyday sense ("French
+# Revolution", "Latin America", "drawing on the documents", "music of the
+# Harlem Renaissance") is not an alias; prompts need a form like "ap french"
+# or "french language".
+COURSES = {
+    "united-states-history": ["united states history", "us history", "u s history", "american history", "apush"],
+    "2-d-art-and-design": ["2 d art and design", "2 d art", "2d art", "2d design"],
+    "3-d-art-and-design": ["3 d art and design", "3 d art", "3d art", "3d design"],
+    "drawing": ["ap drawing"],
+    "art-history": ["art history", "arth"],
+    "music-theory": ["music theory", "ap music"],
+    "english-language-and-composition": ["english language and composition", "english language", "ap lang", "eng lang"],
+    "english-literature-and-composition": ["english literature and composition", "english literature", "english lit", "ap lit", "eng lit"],
+    "african-american-studies": ["african american studies", "aaas"],
+    "comparative-government-and-politics": ["comparative government and politics", "comparative government", "comp gov", "comp govt"],
+    "european-history": ["european history", "euro history", "apeuro", "apeh", "ap euro"],
+    "human-geography": ["human geography", "aphug", "ap hug", "ap geography", "ap human geo"],
+    "macroeconomics": ["macroeconomics", "macroecon", "ap macro"],
+    "microeconomics": ["microeconomics", "microecon", "ap micro"],
+    "psychology": ["psychology", "ap psych"],
+    "united-states-government-and-politics": [
+        "united states government and politics", "us government and politics", "us government",
+        "united states government", "us gov", "us govt", "gov and politics", "gopo", "ap government", "ap gov", "ap govt"
+    ],
+    "world-history": ["world history modern", "world history", "whap"],
+    "biology": ["biology", "ap bio"],
+    "environmental-science": ["environmental science", "enviro sci", "apes", "ap enviro", "ap environmental"],
+    "chinese-language-and-culture": ["chinese language and culture", "chinese language", "ap chinese"],
+    "french-language-and-culture": ["french language and culture", "french language", "ap french"],
+    "german-language-and-culture": ["german language and culture", "german language", "ap german"],
+    "italian-language-and-culture": ["italian language and culture", "italian language", "ap italian"],
+    "japanese-language-and-culture": ["japanese language and culture", "japanese language", "ap japanese"],
+    "latin": ["ap latin", "latin language", "latin literature"],
+    "spanish-language-and-culture": ["spanish language and culture", "spanish language", "spanish lang", "ap spanish"],
+    "spanish-literature-and-culture": ["spanish literature and culture", "spanish literature", "spanish lit"],
+    "computer-science-a": ["computer science a", "comp sci a", "cs a", "csa"],
+    "computer-science-principles": ["computer science principles", "comp sci principles", "cs principles", "csp"],
+}
+# Bare words that are safe in PDF file names (ap23-frq-french.pdf) but not in prompts
+FILE_ALIASES = {
+    "drawing": ["drawing"],
+    "music-theory": ["music"],
+    "human-geography": ["hug", "geography"],
+    "psychology": ["psych"],
+    "environmental-science": ["enviro", "environmental"],
+    "european-history": ["euro"],
+    "macroeconomics": ["macro"],
+    "microeconomics": ["micro"],
+    "united-states-government-and-politics": ["government", "gov"],
+    "biology": ["bio"],
+    "chinese-language-and-culture": ["chinese"],
+    "french-language-and-culture": ["french"],
+    "german-language-and-culture": ["german"],
+    "italian-language-and-culture": ["italian"],
+    "japanese-language-and-culture": ["japanese"],
+    "latin": ["latin"],
+    "spanish-language-and-culture": ["spanish"],
+}
+
+
+def _words(text: str) -> str:
+    """Lowercase text and reduce it to single-space separated words."""
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def _compile(tables: List[Dict[str, List[str]]]) -> List:
+    """(pattern, course, alias length), longest first, so "spanish literature" beats "spanish"."""
+    return sorted(
+        (
+            (re.compile(rf"\b{re.escape(_words(alias))}\b"), course, len(_words(alias)))
+            for table in tables
+            for course, aliases in table.items()
+            for alias in aliases
+        ),
+        key=lambda alias: alias[2],
+        reverse=True
+    )
+
+
+_ALIASES = _compile([COURSES])
+_FILE_ALIASES = _compile([COURSES, FILE_ALIASES])
+
+
+def _match(text: str, aliases: List = _ALIASES) -> Optional[str]:
+    """The course whose longest alias appears in text, or None if absent or ambiguous."""
+    text = _words(text)
+    best_length, found = 0, set()
+    for pattern, course, length in aliases:
+        if length < best_length:
+            break
+        if pattern.search(text):
+            best_length = length
+            found.add(course)
+    return found.pop() if len(found) == 1 else None
+
+
+def course_from_url(url: str) -> Optional[str]:
+    """Course id from an apcentral URL such as .../courses/ap-biology/exam/..."""
+    parts = urlparse(url).path.strip("/").split("/")
+    if "courses" in parts and parts.index("courses") + 1 < len(parts):
+        slug = parts[parts.index("courses") + 1]
+        return slug[3:] if slug.startswith("ap-") else slug
+    return None
+
+
+def course_from_pdf(pdf_file: str) -> Optional[str]:
+    """Best-effort course id from a PDF file name like ap23-frq-us-history.pdf."""
+    return _match(pdf_file, _FILE_ALIASES)
+
+
+def infer_course(prompt: str) -> Optional[str]:
+    """Course id a prompt names unambiguously, e.g. 'APUSH DBQ tips', else None."""
+    return _match(prompt)
+
+
+def tag_course(pdf_file: str, source_url: Optional[str] = None) -> Optional[str]:
+    """Course for a chunk: from the page its PDF was downloaded from, else from the file name."""
+    return (course_from_url(source_url) if source_url else None) or course_from_pdf(pdf_file)
+
+
+def rows_by_course(courses: Iterable[Optional[str]]) -> Dict[str, List[int]]:
+    """Group row numbers by course tag; untagged rows are left out."""
+    groups = {}
+    for row, course in enumerate(courses):
+        if course:
+            groups.setdefault(course, []).append(row)
+    return groups
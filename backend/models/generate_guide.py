@@ -1,27 +1,14 @@
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
+from .llm_gateway import LLMGateway, get_gateway
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the OpenAI client with your project-scoped API key
-client = OpenAI(
-    api_key=os.getenv("OPENAI_PROJECT_API_KEY")  # Ensure your API key is stored securely
-)
+# Follow-ups on a saved study guide use the project-scoped key and gpt-4o-mini, with no answer-length cap
+STUDY_GUIDE_PARAMS = {"model": "gpt-4o-mini", "store": True}
 
-def generate_study_guide(prompt):
-    try:
-        # Use the OpenAI client to generate a response
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",  # Specify the model
-            store=True,  # Store the completion if required
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant for generating study guides."},
-                {"role": "user", "content": f"Create a study guide for: {prompt}"}
-            ]
-        )
-        # Extract and return the generated content using dot notation
-        return completion.choices[0].message.content
-    except Exception as e:
-        raise Exception(f"Error generating study guide: {e}")
+
+def study_guide_llm() -> LLMGateway:
+    """The shared gateway for the project-scoped API key."""
+    return get_gateway(os.getenv("OPENAI_PROJECT_API_KEY"))
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Dict, List, Optional
+
+from .llm_gateway import LLMGateway
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+METRICS.describe("rag_llm_hedges_total", "Second requests sent because the first was slower than the hedge delay.")
+METRICS.describe("rag_llm_hedge_wins_total", "Hedged calls answered by the second request.")
+METRICS.describe("rag_llm_deadline_exceeded_total", "Calls that missed their deadline, by what answered instead.")
+
+
+class DeadlineExceeded(Exception):
+    """No completion arrived within the call's deadline and there is no fallback model."""
+
+
+class HedgedLLM:
+    """
+    Tail-latency control for chat completions sent through an LLMGateway.
+
+    With hedging on, a call still unanswered after the model's recent
+    hedge_percentile latency (at least min_hedge_delay seconds) sends one
+    identical second request and takes whichever finishes first; the other
+    is cancelled. No hedge is sent until the gateway has enough latency
+    samples for the model, and none while hedges already exceed
+    max_hedge_rate of all calls, so a saturated API, where every call is
+    slow, is not sent twice the load. With a deadline, a call unanswered
+    after deadline seconds is abandoned and sent once more to
+    fallback_model, a faster model, or fails with DeadlineExceeded when
+    there is none.
+
+    astream() applies the deadline to the first token: a stream that has
+    produced no content by then is closed and re-opened on fallback_model.
+    Nothing has reached the caller at that point, so the answer is never a
+    splice of two models. Streams are not hedged.
+
+    Hedges and fallbacks are counted, so the extra spend shows in stats()
+    and /metrics. The sync chat() runs requests on worker threads, and a
+    losing sync request cannot be interrupted: it finishes in the
+    background.
+    """
+
+    def __init__(self, llm: LLMGateway, deadline: float = 0, hedging: bool = False,
+                 hedge_percentile: float = 95, min_hedge_delay: float = 1.0, max_hedge_rate: float = 0.1,
+                 fallback_model: Optional[str] = None):
+        self.llm = llm
+        self.deadline = deadline
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_rate = max_hedge_rate
+        self.fallback_model = fallback_model
+        self.calls = 0
+        self.streams = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=2 * llm.max_concurrency, thread_name_prefix="llm-hedge"
+        )
+
+    def _hedge_delay(self, params: Dict) -> Optional[float]:
+        """Seconds to wait for the first request before hedging it, or None for no hedge."""
+        if not self.hedging:
+            return None
+        latency = self.llm.latency_percentile(params.get("model"), self.hedge_percentile)
+        return None if latency is None else max(self.min_hedge_delay, latency)
+
+    def _hedge(self) -> bool:
+        """Count a hedge about to be sent, unless hedges are already over budget."""
+        with self._lock:
+            if self.hedges >= self.max_hedge_rate * self.calls:
+                return False
+            self.hedges += 1
+        METRICS.increment("rag_llm_hedges_total")
+        return True
+
+    def _count(self, field: str, metric: str, **labels):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+        METRICS.increment(metric, **labels)
+
+    def _missed_deadline(self, params: Dict) -> Dict:
+        """Fallback params after a missed deadline; raises DeadlineExceeded when there is no fallback."""
+        outcome = "fallback" if self.fallback_model else "error"
+        self._count("deadline_exceeded", "rag_llm_deadline_exceeded_total", outcome=outcome)
+        if not self.fallback_model:
+            raise DeadlineExceeded(f"No completion within {self.deadline:g}s")
+        logger.info("LLM deadline of %gs passed, falling back to %s", self.deadline, self.fallback_model)
+        with self._lock:
+            self.fallbacks += 1
+        return {**params, "model": self.fallback_model}
+
+    def chat(self, messages: List[Dict], **params):
+        """LLMGateway.chat with hedging and a deadline."""
+        with self._lock:
+            self.calls += 1
+        hedge_delay = self._hedge_delay(params)
+        if hedge_delay is None and not self.deadline:
+            return self.llm.chat(messages, **params)
+
+        started = time.monotonic()
+        primary = self._executor.submit(self.llm.chat, messages, **params)
+        pending, hedge, error = {primary}, None, None
+        while pending:
+            waits = [started + self.deadline - time.monotonic()] if self.deadline else []
+            if hedge is None and hedge_delay is not None:
+                waits.append(started + hedge_delay - time.monotonic())
+            done, pending = wait(pending, timeout=max(0.0, min(waits)) if waits else None,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins", "rag_llm_hedge_wins_total")
+                    return future.result()
+                error = error or future.exception()
+            if not pending:
+                break
+            if self.deadline and time.monotonic() >= started + self.deadline:
+                for future in pending:
+                    future.cancel()
+                return self.llm.chat(messages, **self._missed_deadline(params))
+            if hedge is None and hedge_delay is not None and time.monotonic() >= started + hedge_delay:
+                hedge_delay = None
+                if self._hedge():
+                    hedge = self._executor.submit(self.llm.chat, messages, **params)
+                    pending.add(hedge)
+        raise error
+
+    async def achat(self, messages: List[Dict], **params):
+        """LLMGateway.achat with hedging and a deadline; losing requests are cancelled."""
+        with self._lock:
+            self.calls += 1
+        hedge_delay = self._hedge_delay(params)
+        if hedge_delay is None and not self.deadline:
+            return await self.llm.achat(messages, **params)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        primary = asyncio.ensure_future(self.llm.achat(messages, **params))
+        pending, hedge, error = {primary}, None, None
+        try:
+            while pending:
+                waits = [started + self.deadline - loop.time()] if self.deadline else []
+                if hedge is None and hedge_delay is not None:
+                    waits.append(started + hedge_delay - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, min(waits)) if waits else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins", "rag_llm_hedge_wins_total")
+                        return task.result()
+                    error = error or task.exception()
+                if not pending:
+                    break
+                if self.deadline and loop.time() >= started + self.deadline:
+                    for task in pending:
+                        task.cancel()
+                    pending = set()
+                    return await self.llm.achat(messages, **self._missed_deadline(params))
+                if hedge is None and hedge_delay is not None and loop.time() >= started + hedge_delay:
+                    hedge_delay = None
+                    if self._hedge():
+                        hedge = asyncio.ensure_future(self.llm.achat(messages, **params))
+                        pending.add(hedge)
+            raise error
+        finally:
+            # The loser, or everything if the caller was cancelled; frees its slot and connection
+            for task in pending:
+                task.cancel()
+
+    async def astream(self, messages: List[Dict], **params) -> AsyncIterator:
+        """LLMGateway.astream with the deadline applied to the first content token."""
+        with self._lock:
+            self.streams += 1
+        if not self.deadline:
+            async for chunk in self.llm.astream(messages, **params):
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        stream = self.llm.astream(messages, **params)
+        # Chunks before the first token (the role delta) are held back until it arrives
+        held = []
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                held.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+        except asyncio.TimeoutError:
+            # Cancelling the read closed the stream and freed its slot; start over on the fallback
+            await stream.aclose()
+            async for chunk in self.llm.astream(messages, **self._missed_deadline(params)):
+                yield chunk
+            return
+
+        try:
+            for chunk in held:
+                yield chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            "deadline": self.deadline,
+            "hedging": self.hedging,
+            "hedge_percentile": self.hedge_percentile,
+            "max_hedge_rate": self.max_hedge_rate,
+            "fallback_model": self.fallback_model,
+            "calls": self.calls,
+            "streams": self.streams,
+            "hedges": self.hedges,
+            "hedge_rate": self.hedges / self.calls if self.calls else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "win_rate": self.hedge_wins / self.hedges if self.hedges else 0.0,
+            "deadline_exceeded": self.deadline_exceeded,
+            "fallbacks": self.fallbacks
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
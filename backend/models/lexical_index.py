@@ -0,0 +1,191 @@
+import json
+import os
+import re
+from collections import Counter
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i if in into is it its "
+    "not of on or she that the their them they this to was were which who will with you".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased alphanumeric terms of text, without stopwords."""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    top_k = min(top_k, scores.shape[0])
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    candidates = np.argpartition(scores, -top_k)[-top_k:] if top_k < scores.shape[0] else np.arange(top_k)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk texts, stored as compact arrays.
+
+    Postings are CSR-style: the documents (store rows) containing term t are
+    docs[offsets[t]:offsets[t + 1]], in ascending order, with their term
+    frequencies in tfs. search() scores the rarest terms first and, once the
+    remaining terms cannot lift an unseen row into the top k, only looks up
+    the rows already in play in the longer postings lists.
+    """
+
+    def __init__(self, terms: Sequence[str], offsets: np.ndarray, docs: np.ndarray, tfs: np.ndarray,
+                 doc_lens: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.terms = list(terms)
+        self.vocab = {term: term_id for term_id, term in enumerate(self.terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        count = len(doc_lens)
+        avg_len = float(doc_lens.mean()) if count else 1.0
+        # Per-row part of the BM25 denominator, so scoring a posting is two array ops
+        self.norms = (k1 * (1 - b + b * doc_lens / max(avg_len, 1e-9))).astype(np.float32)
+        self.k1 = k1
+        df = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((count - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Highest score any single row can get from each term, for pruning
+        self.term_max = np.zeros(len(self.terms), dtype=np.float32)
+        if len(docs):
+            contributions = self._contributions(np.repeat(np.arange(len(self.terms)), np.diff(offsets)), docs, tfs)
+            nonempty = np.flatnonzero(df)
+            self.term_max[nonempty] = np.maximum.reduceat(contributions, offsets[nonempty])
+
+    def __len__(self) -> int:
+        return len(self.doc_lens)
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.docs.nbytes + self.tfs.nbytes + self.doc_lens.nbytes
+
+    def _contributions(self, term_ids, docs: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        tfs = tfs.astype(np.float32)
+        return self.idf[term_ids] * tfs * (self.k1 + 1) / (tfs + self.norms[docs])
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+    def _query_terms(self, query: str) -> List[int]:
+        return sorted({self.vocab[token] for token in tokenize(query) if token in self.vocab})
+
+    def search(self, query: str, top_k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the top_k (rows, BM25 scores) for query, best first. rows, a
+        sorted array of store rows, restricts the search to those rows.
+        """
+        term_ids = self._query_terms(query)
+        if not term_ids or not len(self):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+
+        # Highest-impact terms first; the long, low-idf lists come last and get pruned
+        term_ids.sort(key=lambda term_id: -self.term_max[term_id])
+        remaining = float(self.term_max[term_ids].sum())
+        scores = np.zeros(len(self), dtype=np.float32)
+        in_play = rows
+        touched, candidates = [], None
+        for term_id in term_ids:
+            remaining -= float(self.term_max[term_id])
+            docs, tfs = self._postings(term_id)
+            if candidates is None:
+                scores[docs] += self._contributions(term_id, docs, tfs)
+                touched.append(docs)
+                pool = scores[in_play] if in_play is not None else scores
+                if pool.shape[0] > top_k and remaining < np.partition(pool, -top_k)[-top_k]:
+                    # No unseen row can reach the top k any more
+                    candidates = np.unique(np.concatenate(touched))
+                    if in_play is not None:
+                        candidates = np.intersect1d(candidates, in_play, assume_unique=True)
+            else:
+                pos = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                hit = docs[pos] == candidates
+                scores[candidates[hit]] += self._contributions(term_id, candidates[hit], tfs[pos[hit]])
+
+        if candidates is None:
+            candidates = np.unique(np.concatenate(touched))
+            if in_play is not None:
+                candidates = np.intersect1d(candidates, in_play, assume_unique=True)
+        best = candidates[_top_k(scores[candidates], top_k)]
+        return best, scores[best]
+
+    def score_rows(self, query: str, rows: np.ndarray) -> np.ndarray:
+        """BM25 scores of query for the given store rows."""
+        rows = np.asarray(rows, dtype=np.intp)
+        scores = np.zeros(len(rows), dtype=np.float32)
+        order = np.argsort(rows)
+        sorted_rows = rows[order]
+        for term_id in self._query_terms(query):
+            docs, tfs = self._postings(term_id)
+            if not len(docs):
+                continue
+            pos = np.minimum(np.searchsorted(docs, sorted_rows), len(docs) - 1)
+            hit = docs[pos] == sorted_rows
+            scores[order[hit]] += self._contributions(term_id, sorted_rows[hit], tfs[pos[hit]])
+        return scores
+
+    def save(self, directory: str):
+        with open(os.path.join(directory, "lexical_terms.json"), "w") as f:
+            json.dump(self.terms, f)
+        np.save(os.path.join(directory, "lexical_offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "lexical_docs.npy"), self.docs)
+        np.save(os.path.join(directory, "lexical_tfs.npy"), self.tfs)
+        np.save(os.path.join(directory, "lexical_doc_lens.npy"), self.doc_lens)
+
+    @classmethod
+    def load(cls, directory: str) -> "LexicalIndex":
+        with open(os.path.join(directory, "lexical_terms.json")) as f:
+            terms = json.load(f)
+        return cls(
+            terms,
+            np.load(os.path.join(directory, "lexical_offsets.npy")),
+            np.load(os.path.join(directory, "lexical_docs.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "lexical_tfs.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "lexical_doc_lens.npy"))
+        )
+
+
+class LexicalIndexBuilder:
+    """
+    Accumulates chunk texts one at a time, in store row order, and assembles
+    a LexicalIndex from them. Each text is tokenized once when added, so a
+    store that grows only pays for its new chunks.
+    """
+
+    def __init__(self):
+        self.vocab = {}
+        self.doc_terms = []
+        self.doc_tfs = []
+        self.doc_lens = []
+
+    def __len__(self) -> int:
+        return len(self.doc_lens)
+
+    def add(self, text: str):
+        counts = Counter(tokenize(text))
+        vocab = self.vocab
+        term_ids = [vocab.setdefault(token, len(vocab)) for token in counts]
+        self.doc_terms.append(np.array(term_ids, dtype=np.int32))
+        self.doc_tfs.append(np.minimum(np.fromiter(counts.values(), dtype=np.int64, count=len(counts)), 65535).astype(np.uint16))
+        self.doc_lens.append(sum(counts.values()))
+
+    def build(self) -> LexicalIndex:
+        terms = sorted(self.vocab, key=self.vocab.get)
+        if self.doc_terms:
+            term_ids = np.concatenate(self.doc_terms)
+            tfs = np.concatenate(self.doc_tfs)
+        else:
+            term_ids, tfs = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint16)
+        docs = np.repeat(np.arange(len(self), dtype=np.int32), [len(t) for t in self.doc_terms])
+        # Stable sort keeps each term's postings in ascending row order
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(term_ids, minlength=len(terms)))
+        return LexicalIndex(terms, offsets, docs[order], tfs[order], np.asarray(self.doc_lens, dtype=np.float32))
@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+import openai
+import tiktoken
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion
+
+from .completion_cache import DEFAULT_CACHE_DIR, CompletionCache
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+METRICS.describe("rag_llm_requests_total", "Chat completion calls by outcome, after retries.")
+METRICS.describe("rag_llm_retries_total", "Chat completion attempts retried after a transient error.")
+METRICS.describe("rag_llm_throttle_seconds", "Time calls waited for the RPM/TPM limits.")
+METRICS.describe("rag_llm_cache_lookups_total", "Completion cache lookups by result.")
+
+# Errors worth another attempt: throttling, timeouts, dropped connections and 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
+# Completion length assumed for TPM accounting when a call sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+# Fewest latency samples a model needs before latency_percentile reports one
+MIN_LATENCY_SAMPLES = 20
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits as two token buckets
+    that refill continuously.
+
+    reserve() takes a request's share from both buckets straight away and
+    returns how long the caller must wait before sending it, so sync and
+    async callers share one limiter and simply sleep that long. A limit of
+    0 is not enforced.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.limits = (requests_per_minute, tokens_per_minute)
+        self.levels = [float(requests_per_minute), float(tokens_per_minute)]
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        self.updated = now
+        for i, limit in enumerate(self.limits):
+            if limit:
+                self.levels[i] = min(limit, self.levels[i] + elapsed * limit / 60.0)
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve one request of tokens tokens; return the seconds to wait before sending it."""
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = 0.0
+            for i, (limit, cost) in enumerate(zip(self.limits, (1, tokens))):
+                if not limit:
+                    continue
+                # A request larger than the whole bucket waits for a full one rather than forever
+                self.levels[i] -= min(cost, limit)
+                if self.levels[i] < 0:
+                    wait = max(wait, -self.levels[i] * 60.0 / limit)
+            return wait
+
+    def settle(self, reserved: int, used: int):
+        """Return (or charge) the difference once a response reports its actual token usage."""
+        if not self.limits[1]:
+            return
+        with self._lock:
+            self.levels[1] = min(self.limits[1], self.levels[1] + min(reserved, self.limits[1]) - used)
+
+
+class LLMGateway:
+    """
+    Single entry point for chat completions.
+
+    Sync and async calls each go through one OpenAI client on a shared,
+    bounded HTTP connection pool with explicit timeouts. Every call waits
+    for a concurrency slot and for the RPM/TPM limiter, and retryable
+    failures are retried with full-jitter exponential backoff (honouring
+    Retry-After when the server sends it). The clients' own retries are
+    turned off so there is exactly one retry policy.
+
+    With a CompletionCache, chat() and achat() answer repeated requests
+    from disk without a call or a rate-limit charge; streams always go to
+    the API.
+
+    The latencies of the last latency_window successful API calls are kept
+    per model, for latency_percentile() (used to time hedged requests).
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_concurrency: int = 8, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 timeout: float = 60.0, max_connections: int = 32, model: str = "gpt-4",
+                 cache: Optional[CompletionCache] = None, latency_window: int = 200):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.cache = cache
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # asyncio semaphores belong to one event loop; made on first async use
+        self._async_slots = None
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        http_timeout = httpx.Timeout(timeout, connect=min(timeout, 10.0))
+        self.client = OpenAI(
+            api_key=api_key, base_url=base_url, max_retries=0, timeout=http_timeout,
+            http_client=httpx.Client(limits=limits, timeout=http_timeout)
+        )
+        self.async_client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url, max_retries=0, timeout=http_timeout,
+            http_client=httpx.AsyncClient(limits=limits, timeout=http_timeout)
+        )
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+        self.latency_window = latency_window
+        self._latencies: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def estimate_tokens(self, messages: List[Dict], params: Dict) -> int:
+        """Prompt tokens plus the completion budget, as charged against the TPM limit."""
+        prompt = sum(len(self.encoding.encode(message["content"])) + 4 for message in messages)
+        return prompt + (params.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+    def _reserve(self, tokens: int) -> float:
+        """Take one attempt's share of the RPM/TPM limits; return the seconds to wait first."""
+        wait = self.limiter.reserve(tokens)
+        if wait:
+            with self._lock:
+                self.throttled_seconds += wait
+            METRICS.observe("rag_llm_throttle_seconds", wait)
+        return wait
+
+    def _settle(self, tokens: int, completion):
+        usage = getattr(completion, "usage", None)
+        if usage is not None and usage.total_tokens:
+            self.limiter.settle(tokens, usage.total_tokens)
+
+    def _backoff(self, attempt: int, error: Exception, tokens: int) -> Optional[float]:
+        """Seconds to sleep before the next attempt, or None if the error is final."""
+        # A failed attempt generated nothing, so its tokens go back to the TPM bucket
+        self.limiter.settle(tokens, 0)
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt >= self.max_retries:
+            with self._lock:
+                self.failures += 1
+            METRICS.increment("rag_llm_requests_total", outcome="error")
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        with self._lock:
+            self.retries += 1
+        METRICS.increment("rag_llm_retries_total", error=type(error).__name__)
+        logger.info("LLM call failed (%s), retrying in %.2fs", type(error).__name__, delay)
+        return delay
+
+    def _succeeded(self, model: Optional[str] = None, latency: Optional[float] = None):
+        with self._lock:
+            self.calls += 1
+            if latency is not None:
+                self._latencies.setdefault(model, deque(maxlen=self.latency_window)).append(latency)
+        METRICS.increment("rag_llm_requests_total", outcome="ok")
+
+    def latency_percentile(self, model: Optional[str], percentile: float) -> Optional[float]:
+        """Recent completion latency of model at percentile, in seconds; None until there are enough samples."""
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[max(0, math.ceil(percentile / 100.0 * len(samples)) - 1)]
+
+    def _cached(self, messages: List[Dict], params: Dict):
+        """(cache key, stored completion or None); (None, None) without a cache."""
+        if self.cache is None:
+            return None, None
+        key = self.cache.key({"messages": messages, **params})
+        stored = self.cache.get(key)
+        METRICS.increment("rag_llm_cache_lookups_total", result="hit" if stored is not None else "miss")
+        return key, ChatCompletion.model_validate(stored) if stored is not None else None
+
+    def _store(self, key: Optional[str], completion):
+        if key is not None:
+            self.cache.put(key, completion.model_dump(mode="json"))
+
+    def chat(self, messages: List[Dict], **params):
+        """Create a chat completion, blocking until a slot and the rate limits allow it."""
+        key, cached = self._cached(messages, params)
+        if cached is not None:
+            return cached
+        tokens = self.estimate_tokens(messages, params)
+        attempt = 0
+        while True:
+            # Every attempt, retries included, counts against the limits
+            wait = self._reserve(tokens)
+            if wait:
+                time.sleep(wait)
+            with self._slots:
+                try:
+                    sent = time.perf_counter()
+                    completion = self.client.chat.completions.create(messages=messages, **params)
+                    self._succeeded(params.get("model"), time.perf_counter() - sent)
+                    self._settle(tokens, completion)
+                    self._store(key, completion)
+                    return completion
+                except Exception as e:
+                    delay = self._backoff(attempt, e, tokens)
+                    if delay is None:
+                        raise
+            time.sleep(delay)
+            attempt += 1
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        return self._async_slots
+
+    async def achat(self, messages: List[Dict], **params):
+        """Async chat(); waiting for a slot or the rate limits never blocks the event loop."""
+        key, cached = self._cached(messages, params)
+        if cached is not None:
+            return cached
+        tokens = self.estimate_tokens(messages, params)
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            async with self._async_semaphore():
+                try:
+                    sent = time.perf_counter()
+                    completion = await self.async_client.chat.completions.create(messages=messages, **params)
+                    self._succeeded(params.get("model"), time.perf_counter() - sent)
+                    self._settle(tokens, completion)
+                    self._store(key, completion)
+                    return completion
+                except Exception as e:
+                    delay = self._backoff(attempt, e, tokens)
+                    if delay is None:
+                        raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def astream(self, messages: List[Dict], **params) -> AsyncIterator:
+        """
+        Stream a chat completion's chunks. Opening the stream is retried like
+        achat(); once chunks have arrived a failure is raised to the caller.
+        The concurrency slot is held until the stream is exhausted.
+        """
+        tokens = self.estimate_tokens(messages, params)
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            async with self._async_semaphore():
+                try:
+                    stream = await self.async_client.chat.completions.create(
+                        messages=messages, stream=True, **params
+                    )
+                except Exception as e:
+                    delay = self._backoff(attempt, e, tokens)
+                    if delay is None:
+                        raise
+                else:
+                    self._succeeded()
+                    try:
+                        async for chunk in stream:
+                            yield chunk
+                    finally:
+                        # Frees the pooled connection if the caller stops early
+                        await stream.close()
+                    return
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "throttled_seconds": self.throttled_seconds,
+            "max_concurrency": self.max_concurrency,
+            "requests_per_minute": self.limiter.limits[0],
+            "tokens_per_minute": self.limiter.limits[1],
+            "cache": self.cache.stats() if self.cache is not None else None
+        }
+
+    def close(self):
+        self.client.close()
+
+    async def aclose(self):
+        await self.async_client.close()
+
+
+def _cache_from_env() -> Optional[CompletionCache]:
+    mode = os.getenv("LLM_CACHE_MODE", "off")
+    if mode == "off":
+        return None
+    return CompletionCache(
+        directory=os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR),
+        max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "256")) * 2**20),
+        mode=mode
+    )
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(api_key: Optional[str] = None) -> LLMGateway:
+    """
+    The process-wide gateway for an API key (OPENAI_API_KEY by default),
+    configured from the LLM_* environment variables on first use.
+    LLM_CACHE_MODE=read_write or read_only turns on the completion cache.
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    with _gateways_lock:
+        gateway = _gateways.get(api_key)
+        if gateway is None:
+            gateway = _gateways[api_key] = LLMGateway(
+                api_key=api_key,
+                base_url=os.getenv("OPENAI_BASE_URL"),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                requests_per_minute=float(os.getenv("LLM_RPM_LIMIT", "0")),
+                tokens_per_minute=float(os.getenv("LLM_TPM_LIMIT", "0")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+                backoff_base=float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+                backoff_max=float(os.getenv("LLM_BACKOFF_MAX", "20")),
+                timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "32")),
+                cache=_cache_from_env()
+            )
+        return gateway
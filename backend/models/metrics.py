@@ -0,0 +1,145 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
+
+from pymongo import monitoring
+
+# Upper bounds in seconds; stages range from sub-millisecond scoring to multi-second LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+
+def _format(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values."""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterable[Tuple[float, int]]:
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """
+    Process-wide histograms, counters and gauges, rendered in the Prometheus
+    text exposition format for the /metrics endpoint.
+
+    Series are keyed by metric name plus labels and created on first use.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Time a block as one observation of rag_stage_seconds{stage=...}."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("rag_stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            families = {}
+            for (name, labels), histogram in self._histograms.items():
+                families.setdefault((name, "histogram"), []).append((dict(labels), histogram))
+            for (name, labels), value in self._counters.items():
+                families.setdefault((name, "counter"), []).append((dict(labels), value))
+            for (name, labels), value in self._gauges.items():
+                families.setdefault((name, "gauge"), []).append((dict(labels), value))
+
+            for (name, kind), series in sorted(families.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series, key=lambda s: sorted(s[0].items())):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_labels(labels)} {_format(value)}")
+                        continue
+                    for bound, count in value.cumulative():
+                        lines.append(f"{name}_bucket{_labels({**labels, 'le': _format(bound)})} {count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_format(value.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener that counts every round trip to the server
+    (find, getMore, count, ...) and records how long each one took.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.increment("rag_mongo_round_trips_total", command=event.command_name)
+        self.metrics.observe("rag_mongo_round_trip_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        self.metrics.increment("rag_mongo_round_trips_total", command=event.command_name)
+        self.metrics.increment("rag_mongo_errors_total", command=event.command_name)
+
+
+METRICS = Metrics()
+METRICS.describe("rag_stage_seconds", "Time spent in each stage of the RAG pipeline.")
+METRICS.describe("rag_mongo_round_trips_total", "MongoDB commands sent by the RAG pipeline.")
+METRICS.describe("rag_mongo_round_trip_seconds", "MongoDB command latency.")
+METRICS.describe("rag_mongo_errors_total", "MongoDB commands that failed.")
+METRICS.describe("rag_startup_phase_seconds", "Duration of each startup phase.")
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings keyed on normalized query text.
+
+    Entries belong to one embedding model; switching models with set_model
+    empties the cache so stale vectors are never returned.
+    """
+
+    def __init__(self, maxsize: int = 1024, model_name: str = None):
+        self.maxsize = maxsize
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Case- and whitespace-insensitive cache key."""
+        return " ".join(text.lower().split())
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.normalize(text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, text: str, embedding: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        key = self.normalize(text)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def set_model(self, model_name: str):
+        """Record the embedding model in use, clearing the cache if it changed."""
+        with self._lock:
+            if model_name != self.model_name:
+                self._entries.clear()
+                self.model_name = model_name
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "model": self.model_name
+        }
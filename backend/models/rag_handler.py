@@ -1,130 +1,654 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from pymongo import MongoClient
-from openai import OpenAI
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from .vector_store import MappedVectorStore, VectorStore, mmr_select, rescored_top_k, top_k_indices
+from .ann_index import AnnIndex, DEFAULT_INDEX_PATH, load_shard_indexes
+from .courses import infer_course, rows_by_course
+from . import quantization
+from .query_cache import EmbeddingCache
+from .response_cache import SemanticResponseCache
+from .batch_encoder import BatchingEncoder
+from .context_builder import ContextBuilder
+from .reranker import Reranker
+from .startup_timer import StartupTimer
+from .metrics import METRICS, MongoCommandMetrics
+from .llm_gateway import get_gateway
+from .hedged_llm import HedgedLLM
+from .working_set import chunk_key, merge_working_set, neighbour_keys
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+LLM_PARAMS = {"model": "gpt-4", "max_tokens": 300, "temperature": 0.7}
+METRICS.describe("rag_working_set_lookups_total", "Follow-up retrievals served from a guide's working set, or sent to global search.")
+NO_CONTEXT_RESPONSE = (
+    "I couldn't find any relevant information to answer your question. "
+    "Could you please rephrase or ask something else?"
+)
+
 class RAGHandler:
-    def __init__(self):
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.mongo_uri = os.getenv("MONGO_URI")
-        self.client = MongoClient(self.mongo_uri)
-        self.db = self.client["pdf_chunks_db"]
-        self.chunks_collection = self.db["chunks"]
-        self.ai_client = OpenAI()
-        self.ai_client.api_key = os.getenv("OPENAI_API_KEY")
-
-    def retrieve_relevant_chunks(self, query: str, top_k: int = 5, similarity_threshold: float = 0.3) -> List[Dict]:
-        """Retrieve the most relevant chunks for a given query using cosine similarity."""
+    def __init__(self, startup_timer: Optional[StartupTimer] = None):
+        self.startup_timer = startup_timer or StartupTimer()
+        self.embedding_model_name = "all-MiniLM-L6-v2"
+        self.model = self._load_model(self.embedding_model_name)
+        self.encoder = BatchingEncoder(
+            self.model,
+            max_batch_size=int(os.getenv("RAG_ENCODE_MAX_BATCH", "32")),
+            max_wait_ms=float(os.getenv("RAG_ENCODE_BATCH_WINDOW_MS", "5"))
+        )
+        self.query_cache = EmbeddingCache(
+            maxsize=int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024")),
+            model_name=self.embedding_model_name
+        )
+        with self.startup_timer.phase("connect_mongo"):
+            self.mongo_uri = os.getenv("MONGO_URI")
+            # Every command the pipeline sends is counted for /metrics
+            self.client = MongoClient(self.mongo_uri, event_listeners=[MongoCommandMetrics(METRICS)])
+            self.db = self.client["pdf_chunks_db"]
+            self.chunks_collection = self.db["chunks"]
+        refresh_interval = float(os.getenv("RAG_REFRESH_INTERVAL", "30"))
+        # "dense" ranks by cosine alone; "hybrid" fuses cosine with BM25 over the chunk text
+        self.retrieval_mode = os.getenv("RAG_RETRIEVAL_MODE", "dense")
+        self.hybrid_alpha = float(os.getenv("RAG_HYBRID_ALPHA", "0.5"))
+        self.hybrid_candidates = int(os.getenv("RAG_HYBRID_CANDIDATES", "50"))
+        store_dir = os.getenv("RAG_VECTOR_STORE_DIR")
+        if store_dir:
+            # Shared read-only mapping of the files the ingestion job publishes
+            self.vector_store = MappedVectorStore(store_dir, refresh_interval=refresh_interval)
+        else:
+            self.vector_store = VectorStore(
+                self.chunks_collection,
+                refresh_interval=refresh_interval,
+                lexical=self.retrieval_mode == "hybrid"
+            )
+        with self.startup_timer.phase("load_vectors"):
+            self.vector_store.load()
+        self.vector_store.start_polling()
+        with self.startup_timer.phase("load_ann_index"):
+            self.ann_index = self._load_ann_index(os.getenv("RAG_INDEX_BACKEND", "exact"))
+            self.shard_indexes = self._load_shard_indexes()
+        # Per-shard caches, keyed by course (None for the whole corpus)
+        self._ann_rows_cache = {}
+        self.quantization = os.getenv("RAG_QUANTIZATION", "none")
+        self.rescore_oversample = int(os.getenv("RAG_RESCORE_OVERSAMPLE", "10"))
+        self._codes_cache = {}
+        self.infer_courses = os.getenv("RAG_COURSE_INFERENCE", "1") == "1"
+        # (ids, shards) of the snapshot the shards were cut from, replaced as one tuple
+        self._shards = (None, {})
+        self.response_cache = SemanticResponseCache(
+            similarity_threshold=float(os.getenv("RAG_RESPONSE_CACHE_SIMILARITY", "0.95")),
+            ttl_seconds=float(os.getenv("RAG_RESPONSE_CACHE_TTL", "3600")),
+            maxsize=int(os.getenv("RAG_RESPONSE_CACHE_SIZE", "512"))
+        )
+        # Maximal marginal relevance over a wider pool; 0 ranks by relevance alone
+        self.mmr_diversity = float(os.getenv("RAG_MMR_DIVERSITY", "0"))
+        self.mmr_candidates = int(os.getenv("RAG_MMR_CANDIDATES", "50"))
+        # Optional cross-encoder second stage over the top RAG_RERANK_CANDIDATES
+        self.reranker = None
+        self.rerank_candidates = int(os.getenv("RAG_RERANK_CANDIDATES", "20"))
+        if os.getenv("RAG_RERANK", "0") == "1":
+            with self.startup_timer.phase("load_reranker"):
+                self.reranker = Reranker(
+                    model_name=os.getenv("RAG_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+                    budget_ms=float(os.getenv("RAG_RERANK_BUDGET_MS", "150"))
+                )
+        # Follow-ups in a saved guide search the chunks it already retrieved before the corpus
+        self.working_set_size = int(os.getenv("RAG_WORKING_SET_SIZE", "40"))
+        self.working_set_neighbours = int(os.getenv("RAG_WORKING_SET_NEIGHBOURS", "1"))
+        self.working_set_min_score = float(os.getenv("RAG_WORKING_SET_MIN_SCORE", "0.35"))
+        # (ids, {chunk key: row}) of the snapshot the map was built from, replaced as one tuple
+        self._key_rows = (None, {})
+        self._working_set_lock = threading.Lock()
+        self.working_set_hits = 0
+        self.working_set_fallbacks = 0
+        self.context_builder = ContextBuilder(
+            token_budget=int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "2000")),
+            model=LLM_PARAMS["model"]
+        )
+        # Shared, pooled and rate-limited; also used by the async front end
+        self.llm = get_gateway(os.getenv("OPENAI_API_KEY"))
+        # Per-call deadline (0 = none), optional hedging and a faster model for missed deadlines
+        self.hedged_llm = HedgedLLM(
+            self.llm,
+            deadline=float(os.getenv("LLM_DEADLINE", "0")),
+            hedging=os.getenv("LLM_HEDGE", "0") == "1",
+            hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+            min_hedge_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "1")),
+            max_hedge_rate=float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1")),
+            fallback_model=os.getenv("LLM_FALLBACK_MODEL") or None
+        )
+
+    def _load_model(self, model_name: str):
+        """Import sentence_transformers (and torch) on first use and load a model."""
+        with self.startup_timer.phase("import_sentence_transformers"):
+            from sentence_transformers import SentenceTransformer
+        with self.startup_timer.phase(f"load_model:{model_name}"):
+            return SentenceTransformer(model_name)
+
+    def warmup(self):
+        """Run one encode and one search so the first real request pays no warmup cost."""
+        with self.startup_timer.phase("warmup"):
+            self.encoder.encode(["warmup query"])
+            self.retrieve_many(["AP exam study guide"], top_k=1)
+
+    def _load_ann_index(self, backend: str):
+        """Load the ANN index built at ingestion, or None to search exhaustively."""
+        if backend == "exact":
+            return None
+        index_path = os.getenv("RAG_INDEX_PATH", DEFAULT_INDEX_PATH)
         try:
-            print(f"\n[RAG] Processing query: {query}")
-            query_emb = self.model.encode(query).astype(np.float32)
+            ann_index = AnnIndex.load(index_path)
+        except Exception as e:
+            logger.warning("Could not load %s index from %s, using exact search: %s", backend, index_path, e)
+            return None
+        ann_index.set_search_params(
+            ef_search=int(os.getenv("RAG_HNSW_EF_SEARCH", "64")),
+            nprobe=int(os.getenv("RAG_IVF_NPROBE", "16"))
+        )
+        logger.info("Loaded %s index over %d chunks", ann_index.kind, len(ann_index))
+        return ann_index
 
-            # Load all vectors and metadata from MongoDB
-            print("[RAG] Attempting to fetch chunks from MongoDB...")
-            try:
-                cursor = self.chunks_collection.find({}, {"embedding": 1, "pdf_file": 1, "chunk_index": 1, "chunk_text": 1})
-                metadata, embeddings = [], []
-                for doc in cursor:
-                    embeddings.append(doc["embedding"])
-                    metadata.append({
-                        "pdf_file": doc["pdf_file"],
-                        "chunk_index": doc["chunk_index"],
-                        "chunk_text": doc["chunk_text"]
-                    })
-            except Exception as db_error:
-                print(f"[RAG] Database error: {str(db_error)}")
-                raise
-
-            if not embeddings:
-                print("[RAG] No chunks found in the database!")
-                return []
-
-            print(f"[RAG] Found {len(embeddings)} total chunks in database")
-            embeddings = np.array(embeddings, dtype=np.float32)
-
-            # Compute cosine similarity
-            print("[RAG] Computing similarities...")
-            similarities = np.dot(embeddings, query_emb) / (
-                np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_emb)
-            )
-            top_indices = np.argsort(similarities)[-top_k:][::-1]
-
-            # Filter by similarity threshold
-            results = []
-            for idx in top_indices:
-                if similarities[idx] >= similarity_threshold:
-                    results.append({**metadata[idx], "score": float(similarities[idx])})
-                    print(f"\n[RAG] Retrieved chunk from {metadata[idx]['pdf_file']}")
-                    print(f"[RAG] Similarity score: {similarities[idx]:.3f}")
-                    print(f"[RAG] Preview: {metadata[idx]['chunk_text'][:200]}...")
-
-            print(f"\n[RAG] Retrieved {len(results)} relevant chunks above threshold {similarity_threshold}")
-            return results
+    def _load_shard_indexes(self) -> Dict[str, AnnIndex]:
+        """Load the per-course indexes built next to the full index, if any."""
+        if self.ann_index is None:
+            return {}
+        index_path = os.getenv("RAG_INDEX_PATH", DEFAULT_INDEX_PATH)
+        try:
+            shard_indexes = load_shard_indexes(index_path)
         except Exception as e:
-            print(f"[RAG] Error in retrieve_relevant_chunks: {str(e)}")
+            logger.warning("Could not load course shard indexes, searching shards exactly: %s", e)
+            return {}
+        for shard_index in shard_indexes.values():
+            shard_index.set_search_params(
+                ef_search=int(os.getenv("RAG_HNSW_EF_SEARCH", "64")),
+                nprobe=int(os.getenv("RAG_IVF_NPROBE", "16"))
+            )
+        logger.info("Loaded %d course shard indexes", len(shard_indexes))
+        return shard_indexes
+
+    def retrieve_relevant_chunks(self, query: str, top_k: int = 5, similarity_threshold: float = 0.3,
+                                 course: Optional[str] = None, diversity: Optional[float] = None,
+                                 query_emb: Optional[np.ndarray] = None) -> List[Dict]:
+        """Retrieve the most relevant chunks for a given query using cosine similarity."""
+        try:
+            logger.debug("Processing query: %s", query)
+            query_embs = None if query_emb is None else query_emb[np.newaxis]
+            return self.retrieve_many([query], top_k, similarity_threshold, course, diversity, query_embs)[0]
+        except Exception:
+            logger.exception("Error in retrieve_relevant_chunks")
             raise
 
-    def generate_response_with_context(self, query: str) -> str:
-        """Generate a response using RAG - retrieve relevant chunks and use them as context."""
+    def retrieve_many(self, queries: List[str], top_k: int = 5, similarity_threshold: float = 0.3,
+                      course: Optional[str] = None, diversity: Optional[float] = None,
+                      query_embs: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """
+        Retrieve the most relevant chunks for several queries at once.
+
+        All queries are encoded in one batch and scored with one matrix-matrix
+        product per course shard. course restricts every query to one course;
+        without it each query is routed to the course it names, if any
+        (RAG_COURSE_INFERENCE), and otherwise searches the whole corpus. A
+        query whose inferred course has fewer than top_k hits above the
+        threshold is searched again across the whole corpus.
+        diversity (default RAG_MMR_DIVERSITY) above 0 picks the results from
+        a wider pool by maximal marginal relevance, so near-duplicate chunks
+        do not crowd each other out.
+        retrieve_relevant_chunks goes through this same path, so a query's
+        results do not depend on which entry point was used. query_embs, when
+        the caller has already encoded the queries, skips encoding them again.
+        """
         try:
-            # Get relevant chunks
-            print("\n[RAG] Starting retrieval process...")
-            relevant_chunks = self.retrieve_relevant_chunks(query)
-            
-            if not relevant_chunks:
-                print("[RAG] No relevant chunks found, returning default response")
-                return "I couldn't find any relevant information to answer your question. Could you please rephrase or ask something else?"
-
-            # Build context from relevant chunks
-            context = "\n\n".join(
-                f"Chunk {i+1}: {chunk['chunk_text']}"
-                for i, chunk in enumerate(relevant_chunks)
-            )
+            if query_embs is None:
+                query_embs = self._encode_queries(queries)
+
+            snapshot = self.vector_store.snapshot()
+            embeddings, ids, metadata = snapshot
+            if not metadata:
+                logger.warning("No chunks found in the database")
+                return [[] for _ in queries]
 
-            print("\n[RAG] Sending chunks to LLM for response generation...")
-            print(f"[RAG] OpenAI API Key present: {bool(self.ai_client.api_key)}")
+            logger.debug("Searching %d resident chunks for %d queries", len(metadata), len(queries))
 
-            # Create messages for the chat completion
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an expert assistant. Use the provided context to answer "
-                        "the user's question accurately, quoting from the context when helpful."
+            # With a reranker the first stage keeps a wider pool for it to reorder
+            first_stage_k = max(top_k, self.rerank_candidates) if self.reranker is not None else top_k
+            diversity = self.mmr_diversity if diversity is None else diversity
+            search_k = max(first_stage_k, self.mmr_candidates) if diversity > 0 else first_stage_k
+            candidates = [None] * len(queries)
+            # Stored vectors and the queries are unit length, so the dot product is the cosine
+            with METRICS.stage("score"):
+                routes = self._route(queries, course)
+                for shard_course, positions in routes.items():
+                    found = self._search_shard(
+                        [queries[position] for position in positions], query_embs[positions],
+                        snapshot, search_k, shard_course, similarity_threshold
                     )
-                },
-                {
-                    "role": "system",
-                    "content": f"Context:\n{context}"
-                },
-                {
-                    "role": "user",
-                    "content": query
-                }
+                    for position, query_candidates in zip(positions, found):
+                        candidates[position] = query_candidates
+                # An inferred course is only a guess: if its shard has too few good hits, search everything
+                if course is None:
+                    retry = [
+                        position
+                        for shard_course, positions in routes.items() if shard_course is not None
+                        for position in positions
+                        if len(candidates[position]) < top_k
+                    ]
+                    if retry:
+                        logger.debug("Inferred course shard too thin for %d queries, searching all courses", len(retry))
+                        found = self._search_shard([queries[position] for position in retry], query_embs[retry],
+                                                   snapshot, search_k, None, similarity_threshold)
+                        for position, query_candidates in zip(retry, found):
+                            candidates[position] = query_candidates
+                if diversity > 0:
+                    candidates = [
+                        self._diversify(query_emb, query_candidates, embeddings, first_stage_k, diversity)
+                        for query_emb, query_candidates in zip(query_embs, candidates)
+                    ]
+            return self._hydrate_results(queries, snapshot, candidates, top_k, similarity_threshold)
+        except Exception:
+            logger.exception("Error in retrieve_many")
+            raise
+
+    def _hydrate_results(self, queries: List[str], snapshot, candidates: List[List[Tuple[int, float]]],
+                         top_k: int, similarity_threshold: float) -> List[List[Dict]]:
+        """Fetch the text of each query's (row, score) candidates, already thresholded, and rerank them."""
+        # Scoring never touched chunk text; fetch it for the winners only, in one lookup
+        rows = sorted({row for query_candidates in candidates for row, _ in query_candidates})
+        with METRICS.stage("db_fetch"):
+            chunks = self.vector_store.hydrate(snapshot, rows)
+        results = [
+            self._select_chunks(query_candidates, chunks, similarity_threshold)
+            for query_candidates in candidates
+        ]
+        if self.reranker is not None:
+            with METRICS.stage("rerank"):
+                results = [self._rerank(query, query_chunks)[:top_k] for query, query_chunks in zip(queries, results)]
+        return results
+
+    def retrieve_follow_up(self, query: str, working_set: List[Dict], top_k: int = 5,
+                           similarity_threshold: float = 0.3, course: Optional[str] = None,
+                           diversity: Optional[float] = None, query_emb: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Retrieve chunks for a follow-up question in a saved study guide.
+
+        working_set holds the chunks the guide's earlier questions retrieved
+        (see merge_working_set). Those chunks, plus their neighbours within
+        RAG_WORKING_SET_NEIGHBOURS positions in the same PDF, are scored
+        exactly: a few dozen rows instead of the whole corpus, and answers
+        stay grounded in the material the guide already covers. When fewer
+        than top_k of them reach RAG_WORKING_SET_MIN_SCORE, the question has
+        moved on and the full retrieve_relevant_chunks search runs instead;
+        course only applies to that search. query_emb, when the caller has
+        already encoded query, is used for both.
+        """
+        if not working_set:
+            return self.retrieve_relevant_chunks(query, top_k, similarity_threshold, course, diversity, query_emb)
+        try:
+            if query_emb is None:
+                query_emb = self._encode_queries([query])[0]
+            snapshot = self.vector_store.snapshot()
+            embeddings = snapshot[0]
+            row_of = self._rows_by_key(snapshot)
+            keys = {chunk_key(entry) for entry in working_set}
+            keys.update(neighbour_keys(working_set, self.working_set_neighbours))
+            rows = np.array(sorted(row_of[key] for key in keys if key in row_of), dtype=np.intp)
+
+            with METRICS.stage("score"):
+                scores = np.asarray(embeddings[rows], dtype=np.float32) @ query_emb if rows.size else np.empty(0)
+                hit = np.count_nonzero(scores >= self.working_set_min_score) >= top_k
+                if hit:
+                    first_stage_k = max(top_k, self.rerank_candidates) if self.reranker is not None else top_k
+                    diversity = self.mmr_diversity if diversity is None else diversity
+                    search_k = max(first_stage_k, self.mmr_candidates) if diversity > 0 else first_stage_k
+                    candidates = [(int(rows[i]), scores[i]) for i in top_k_indices(scores, search_k)
+                                  if scores[i] >= similarity_threshold]
+                    if diversity > 0:
+                        candidates = self._diversify(query_emb, candidates, embeddings, first_stage_k, diversity)
+            self._count_working_set(hit)
+            if not hit:
+                logger.debug("Working set of %d chunks scored too low, searching the corpus", len(rows))
+                return self.retrieve_relevant_chunks(query, top_k, similarity_threshold, course, diversity,
+                                                     query_emb)
+            logger.debug("Answered from a working set of %d chunks", len(rows))
+            return self._hydrate_results([query], snapshot, [candidates], top_k, similarity_threshold)[0]
+        except Exception:
+            logger.exception("Error in retrieve_follow_up")
+            raise
+
+    def _rows_by_key(self, snapshot) -> Dict[Tuple[str, int], int]:
+        """Map (pdf_file, chunk_index) to its row, once per snapshot."""
+        ids = snapshot[1]
+        cached = self._key_rows
+        if cached[0] is not ids:
+            cached = self._key_rows = (ids, {
+                (pdf_file, int(chunk_index)): row
+                for row, (pdf_file, chunk_index) in enumerate(self.vector_store.chunk_keys(snapshot))
+            })
+        return cached[1]
+
+    def _count_working_set(self, hit: bool):
+        with self._working_set_lock:
+            if hit:
+                self.working_set_hits += 1
+            else:
+                self.working_set_fallbacks += 1
+        METRICS.increment("rag_working_set_lookups_total", result="hit" if hit else "fallback")
+
+    def working_set_stats(self) -> Dict:
+        lookups = self.working_set_hits + self.working_set_fallbacks
+        return {
+            "max_size": self.working_set_size,
+            "min_score": self.working_set_min_score,
+            "hits": self.working_set_hits,
+            "fallbacks": self.working_set_fallbacks,
+            "hit_rate": self.working_set_hits / lookups if lookups else 0.0
+        }
+
+    def _diversify(self, query_emb: np.ndarray, candidates: List[Tuple[int, float]], embeddings: np.ndarray,
+                   top_k: int, diversity: float) -> List[Tuple[int, float]]:
+        """Pick top_k of one query's (row, score) candidates by maximal marginal relevance."""
+        if not candidates:
+            return candidates
+        rows = np.array([row for row, _ in candidates], dtype=np.intp)
+        picks = mmr_select(query_emb, np.asarray(embeddings[rows], dtype=np.float32), top_k, diversity)
+        return [candidates[pick] for pick in picks]
+
+    def _rerank(self, query: str, chunks: List[Dict]) -> List[Dict]:
+        """Reorder one query's candidates with the cross-encoder, within its time budget."""
+        reranked, stats = self.reranker.rerank(query, chunks)
+        if stats["timed_out"]:
+            logger.info("Rerank deadline of %.0fms passed, keeping first-stage order", self.reranker.budget * 1000)
+        elif stats["candidates"]:
+            logger.debug(
+                "Reranked %d candidates in %.1fms (%.0f%% of budget)",
+                stats["candidates"], stats["used_ms"], stats["budget_used"] * 100
+            )
+        return reranked
+
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Encode queries, reusing cached embeddings. Misses go to the shared
+        batching encoder, which coalesces them with concurrent requests.
+        """
+        cached = [self.query_cache.get(query) for query in queries]
+        missing = [i for i, emb in enumerate(cached) if emb is None]
+        if missing:
+            with METRICS.stage("encode"):
+                encoded = self.encoder.encode([queries[i] for i in missing])
+            for i, emb in zip(missing, encoded):
+                cached[i] = emb
+                self.query_cache.put(queries[i], emb)
+        return np.stack(cached)
+
+    def set_embedding_model(self, model_name: str):
+        """Swap the query embedding model; cached query embeddings are dropped."""
+        self.model = self._load_model(model_name)
+        self.encoder.model = self.model
+        self.embedding_model_name = model_name
+        self.query_cache.set_model(model_name)
+
+    def _route(self, queries: List[str], course: Optional[str]) -> Dict[Optional[str], List[int]]:
+        """Group query positions by the course shard each one searches (None for all chunks)."""
+        routes = {}
+        for position, query in enumerate(queries):
+            query_course = course or (infer_course(query) if self.infer_courses else None)
+            routes.setdefault(query_course, []).append(position)
+        return routes
+
+    def _course_shards(self, snapshot) -> Dict[str, Tuple[np.ndarray, np.ndarray, List]]:
+        """
+        Split a snapshot into per-course (rows, embeddings, ids) shards, once
+        per snapshot. A course whose rows are contiguous, as in the published
+        on-disk store, gets a view of the matrix rather than a copy.
+        """
+        embeddings, ids, _ = snapshot
+        # Pool threads fill this concurrently; read and replace it only as a whole
+        cached = self._shards
+        if cached[0] is not ids:
+            shards = {}
+            for course, rows in rows_by_course(self.vector_store.courses(snapshot)).items():
+                rows = np.asarray(rows, dtype=np.intp)
+                if rows[-1] - rows[0] + 1 == len(rows):
+                    shard_embeddings = embeddings[rows[0]:rows[-1] + 1]
+                else:
+                    shard_embeddings = embeddings[rows]
+                shards[course] = (rows, shard_embeddings, [ids[row] for row in rows])
+            cached = self._shards = (ids, shards)
+        return cached[1]
+
+    def _search_shard(self, queries: List[str], query_embs: np.ndarray, snapshot, top_k: int,
+                      course: Optional[str], similarity_threshold: float) -> List[List[Tuple[int, float]]]:
+        """
+        Search one course shard, or the whole corpus for course None, returning
+        the snapshot rows of the candidates that pass similarity_threshold.
+        """
+        embeddings, ids, _ = snapshot
+        lexical = self.vector_store.lexical_index(snapshot) if self.retrieval_mode == "hybrid" else None
+        # Hybrid mode fuses a wider dense candidate pool with the BM25 candidates
+        pool = max(top_k, self.hybrid_candidates) if lexical is not None else top_k
+        rows = None
+        if course is not None:
+            shard = self._course_shards(snapshot).get(course)
+            if shard is not None:
+                logger.debug("Searching the %s shard (%d chunks)", course, len(shard[0]))
+                rows, shard_embeddings, shard_ids = shard
+                found = self._search(query_embs, shard_embeddings, shard_ids, pool, course)
+                found = [[(int(rows[row]), score) for row, score in hits] for hits in found]
+            else:
+                logger.info("No chunks tagged %s, searching all courses", course)
+        if rows is None:
+            found = self._search(query_embs, embeddings, ids, pool, None)
+        if lexical is None:
+            return [[(row, score) for row, score in hits if score >= similarity_threshold] for hits in found]
+        return [
+            self._fuse_lexical(query, query_emb, hits, lexical, embeddings, rows, similarity_threshold)[:top_k]
+            for query, query_emb, hits in zip(queries, query_embs, found)
+        ]
+
+    def _fuse_lexical(self, query: str, query_emb: np.ndarray, dense_hits: List[Tuple[int, float]],
+                      lexical, embeddings: np.ndarray, rows: Optional[np.ndarray],
+                      similarity_threshold: float) -> List[Tuple[int, float]]:
+        """
+        Rank the union of the dense and BM25 candidates by
+        alpha * cosine + (1 - alpha) * BM25 / (best BM25 in the pool), and
+        return them as (row, cosine) pairs in fused order. Only dense-only
+        candidates must reach similarity_threshold: a BM25 candidate is kept
+        whatever its cosine, since an exact term match is what it adds.
+        """
+        lexical_rows, _ = lexical.search(query, self.hybrid_candidates, rows)
+        pool = np.array(sorted({row for row, _ in dense_hits} | set(lexical_rows.tolist())), dtype=np.intp)
+        if not pool.size:
+            return []
+        cosine = embeddings[pool].astype(np.float64) @ query_emb.astype(np.float64)
+        bm25 = lexical.score_rows(query, pool)
+        if bm25.max() > 0:
+            bm25 = bm25 / bm25.max()
+        fused = self.hybrid_alpha * cosine + (1 - self.hybrid_alpha) * bm25
+        keep = np.isin(pool, lexical_rows) | (cosine >= similarity_threshold)
+        return [(int(pool[i]), cosine[i]) for i in np.argsort(-fused, kind="stable") if keep[i]]
+
+    def _search(self, query_embs: np.ndarray, embeddings: np.ndarray, ids: List, top_k: int,
+                course: Optional[str] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Return the best (row, score) pairs for each query, best first.
+
+        Without an ANN index this is one exact matrix-matrix product, or a
+        quantized first pass rescored in full precision when RAG_QUANTIZATION
+        is set. With an index, the index is searched and any chunks added
+        since it was built are scored exactly and merged in. course picks
+        that shard's index; embeddings and ids are then the shard's rows.
+        """
+        ann_index = self.ann_index if course is None else self.shard_indexes.get(course)
+        if ann_index is None and self.quantization != "none":
+            codes = self._quantized_codes(embeddings, course)
+            return [
+                list(zip(*rescored_top_k(codes.scores(query_emb), embeddings, query_emb, top_k,
+                                         shortlist_size=top_k * self.rescore_oversample)))
+                for query_emb in query_embs
+            ]
+        if ann_index is None:
+            similarities = query_embs @ embeddings.T
+            return [
+                list(zip(*rescored_top_k(row, embeddings, query_emb, top_k)))
+                for row, query_emb in zip(similarities, query_embs)
             ]
 
-            try:
-                print("[RAG] Making API call to OpenAI...")
-                response = self.ai_client.chat.completions.create(
-                    model="gpt-4",
-                    messages=messages,
-                    max_tokens=300,
-                    temperature=0.7
+        row_of, unindexed = self._ann_rows(ids, ann_index, course)
+        tail_similarities = query_embs @ embeddings[unindexed].T if unindexed.size else None
+        results = []
+        for q, hits in enumerate(ann_index.search(query_embs, top_k)):
+            candidates = [(row_of[chunk_id], score) for chunk_id, score in hits if chunk_id in row_of]
+            if tail_similarities is not None:
+                row = tail_similarities[q]
+                candidates += [(int(unindexed[idx]), row[idx]) for idx in top_k_indices(row, top_k)]
+            candidates.sort(key=lambda c: c[1], reverse=True)
+            results.append(candidates[:top_k])
+        return results
+
+    def _quantized_codes(self, embeddings: np.ndarray, course: Optional[str] = None):
+        """Codes for the current snapshot or shard: the ones published with it, or built once here."""
+        cached = self._codes_cache.get(course)
+        if cached is None or cached[0] is not embeddings:
+            codes = self.vector_store.codes.get(self.quantization)
+            if codes is None or len(codes) != len(embeddings):
+                codes = quantization.encode(embeddings, self.quantization)
+            cached = self._codes_cache[course] = (embeddings, codes)
+        return cached[1]
+
+    def _ann_rows(self, ids: List, ann_index: AnnIndex, course: Optional[str] = None) -> Tuple[Dict[str, int], np.ndarray]:
+        """Map index chunk ids to store rows, and list store rows the index does not cover."""
+        cached = self._ann_rows_cache.get(course)
+        if cached is None or cached[0] is not ids:
+            row_of = {str(chunk_id): row for row, chunk_id in enumerate(ids)}
+            unindexed = np.array(
+                [row for row, chunk_id in enumerate(ids) if str(chunk_id) not in ann_index.id_set],
+                dtype=np.intp
+            )
+            cached = self._ann_rows_cache[course] = (ids, (row_of, unindexed))
+        return cached[1]
+
+    def _select_chunks(self, candidates: List[Tuple[int, float]], chunks: Dict[int, Dict], similarity_threshold: float) -> List[Dict]:
+        """Turn one query's (row, score) candidates above the threshold into hydrated chunks."""
+        results = []
+        for idx, score in candidates:
+            if idx not in chunks:
+                continue
+            results.append({**chunks[idx], "score": float(score)})
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Retrieved chunk from %s (score %.3f): %s...",
+                    chunks[idx]["pdf_file"], score, chunks[idx]["chunk_text"][:200]
                 )
-                print("[RAG] Successfully received response from OpenAI")
-                return response.choices[0].message.content.strip()
+
+        logger.debug("Retrieved %d relevant chunks above threshold %s", len(results), similarity_threshold)
+        return results
+
+    def prepare_generation(self, query: str, course: Optional[str] = None,
+                           working_set: Optional[List[Dict]] = None,
+                           prompt: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        Retrieve context for a query and build the chat request for it.
+
+        Returns (response, request). response is set when no LLM call is
+        needed, either because nothing relevant was found (request is then
+        None) or because the semantic cache had an answer. request carries
+        the retrieved chunks, the chat messages and what finish_generation
+        needs, plus "working_set": working_set with the new chunks merged in,
+        for the caller to store on the study guide.
+
+        prompt, when given, is sent to the model in place of query, e.g. a
+        follow-up question with its conversation; retrieval still uses query.
+        Its answer depends on more than the query, so the semantic cache is
+        skipped, and it is answered even when no chunk is relevant: "make
+        that shorter" needs the conversation, not the corpus.
+        """
+        # Encoded once, for retrieval and the semantic cache, so the query cache counts one lookup
+        query_emb = self._encode_queries([query])[0]
+        # Get relevant chunks, starting from the guide's working set for follow-ups
+        if working_set:
+            relevant_chunks = self.retrieve_follow_up(query, working_set, course=course, query_emb=query_emb)
+        else:
+            relevant_chunks = self.retrieve_relevant_chunks(query, course=course, query_emb=query_emb)
+
+        if not relevant_chunks and prompt is None:
+            logger.info("No relevant chunks found, returning default response")
+            return NO_CONTEXT_RESPONSE, None
+
+        # Reuse the answer to a near-identical prompt grounded in the same chunks
+        chunk_keys = frozenset((chunk["pdf_file"], chunk["chunk_index"]) for chunk in relevant_chunks)
+        cached_response = self.response_cache.lookup(query_emb, chunk_keys) if prompt is None else None
+        if cached_response is not None:
+            logger.debug("Semantic cache hit, reusing stored response")
+
+        # Create messages for the chat completion
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You are an expert assistant. Use the provided context to answer "
+                    "the user's question accurately, quoting from the context when helpful."
+                )
+            }
+        ]
+        if relevant_chunks:
+            # Merge overlapping chunks and pack them into the token budget
+            with METRICS.stage("context_build"):
+                context, context_stats = self.context_builder.build(relevant_chunks)
+            logger.debug(
+                "Context: %d tokens in %d segments (plain concatenation: %d)",
+                context_stats["context_tokens"], context_stats["segments"], context_stats["naive_tokens"]
+            )
+            messages.append({"role": "system", "content": f"Context:\n{context}"})
+        else:
+            logger.info("No relevant chunks found, answering from the conversation")
+        messages.append({"role": "user", "content": query if prompt is None else prompt})
+        return cached_response, {
+            "messages": messages,
+            "prompt": prompt,
+            "chunks": relevant_chunks,
+            "query_emb": query_emb,
+            "chunk_keys": chunk_keys,
+            "working_set": merge_working_set(working_set or [], relevant_chunks, self.working_set_size)
+        }
+
+    def finish_generation(self, request: Dict, answer: str, latency: float) -> str:
+        """Record a completed LLM answer in the semantic cache and return it."""
+        if request.get("prompt") is None:
+            self.response_cache.store(request["query_emb"], request["chunk_keys"], answer, latency)
+        return answer
+
+    def generate_response_with_context(self, query: str, course: Optional[str] = None) -> str:
+        """Generate a response using RAG - retrieve relevant chunks and use them as context."""
+        try:
+            response, request = self.prepare_generation(query, course)
+            if response is not None:
+                return response
+
+            try:
+                logger.debug("Making API call to OpenAI...")
+                started = time.perf_counter()
+                with METRICS.stage("llm"):
+                    response = self.hedged_llm.chat(request["messages"], **LLM_PARAMS)
+                answer = response.choices[0].message.content.strip()
+                return self.finish_generation(request, answer, time.perf_counter() - started)
             except Exception as api_error:
-                print(f"[RAG] OpenAI API error: {str(api_error)}")
+                logger.error("OpenAI API error: %s", api_error)
                 return f"I encountered an error while generating the response: {str(api_error)}"
         except Exception as e:
-            print(f"[RAG] Error in generate_response_with_context: {str(e)}")
+            logger.exception("Error in generate_response_with_context")
             return f"An unexpected error occurred: {str(e)}"
 
     def close(self):
-        """Close the MongoDB connection."""
+        """Stop the background workers and close the MongoDB connection."""
+        self.vector_store.stop_polling()
+        self.encoder.close()
+        if self.reranker is not None:
+            self.reranker.close()
+        self.hedged_llm.close()
+        self.llm.close()
         self.client.close() 
\ No newline at end of file
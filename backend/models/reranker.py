@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Tuple
+
+
+class Reranker:
+    """
+    Deadline-bounded second stage that reorders first-stage candidates with
+    a local cross-encoder.
+
+    All (query, chunk) pairs of a request are scored in one batched predict
+    call on a dedicated worker thread. If the scores are not back within
+    budget_ms (time spent queued behind another request counts), the
+    candidates keep their first-stage order and the late result is ignored.
+    """
+
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", budget_ms: float = 150.0,
+                 batch_size: int = 32):
+        # Imported here so the dense-only path never pays for it
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name)
+        self.model_name = model_name
+        self.budget = budget_ms / 1000.0
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self.calls = 0
+        self.timeouts = 0
+        self.used_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _score(self, query: str, chunks: List[Dict]):
+        pairs = [(query, chunk["chunk_text"]) for chunk in chunks]
+        return self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+
+    def rerank(self, query: str, chunks: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """
+        Return (chunks, stats): the chunks ordered by cross-encoder score, or
+        in their original order if the deadline passed. stats has the time
+        used, the share of the budget it represents and whether it timed out.
+        """
+        if not chunks:
+            return chunks, {"candidates": 0, "used_ms": 0.0, "budget_used": 0.0, "timed_out": False}
+
+        started = time.perf_counter()
+        future = self.executor.submit(self._score, query, chunks)
+        try:
+            scores = future.result(timeout=self.budget)
+            timed_out = False
+        except TimeoutError:
+            future.cancel()
+            scores, timed_out = None, True
+        used = time.perf_counter() - started
+
+        with self._lock:
+            self.calls += 1
+            self.timeouts += timed_out
+            self.used_seconds += used
+        stats = {
+            "candidates": len(chunks),
+            "used_ms": used * 1000.0,
+            "budget_used": used / self.budget if self.budget else 0.0,
+            "timed_out": timed_out
+        }
+        if scores is None:
+            return chunks, stats
+
+        order = sorted(range(len(chunks)), key=lambda i: -scores[i])
+        return [{**chunks[i], "rerank_score": float(scores[i])} for i in order], stats
+
+    def stats(self) -> Dict:
+        return {
+            "model": self.model_name,
+            "budget_ms": self.budget * 1000.0,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "mean_used_ms": self.used_seconds / self.calls * 1000.0 if self.calls else 0.0,
+            "mean_budget_used": self.used_seconds / self.calls / self.budget if self.calls and self.budget else 0.0
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
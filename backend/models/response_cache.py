@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional
+
+import numpy as np
+
+
+class SemanticResponseCache:
+    """
+    Cache of generated responses looked up by prompt similarity.
+
+    A stored response is reused when a new prompt's embedding is at least
+    similarity_threshold (cosine) from a cached prompt and retrieval picked
+    exactly the same chunks, so the answer was grounded in the same context.
+    Entries expire after ttl_seconds and the least recently used entry is
+    evicted beyond maxsize.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl_seconds: float = 3600, maxsize: int = 512):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _embedding_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries)
+            self._matrix = np.stack([self._entries[key]["embedding"] for key in self._matrix_keys])
+        return self._matrix
+
+    def lookup(self, query_emb: np.ndarray, chunk_keys: FrozenSet) -> Optional[str]:
+        """Return a cached response for a similar prompt with the same chunks, or None."""
+        with self._lock:
+            self._expire(time.time())
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            similarities = self._embedding_matrix() @ query_emb
+            for idx in np.argsort(-similarities):
+                if similarities[idx] < self.similarity_threshold:
+                    break
+                key = self._matrix_keys[idx]
+                entry = self._entries[key]
+                if entry["chunk_keys"] == chunk_keys:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.latency_saved += entry["latency"]
+                    return entry["response"]
+            self.misses += 1
+            return None
+
+    def store(self, query_emb: np.ndarray, chunk_keys: FrozenSet, response: str, latency: float):
+        """Cache a response along with how long it took to generate."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[self._next_key] = {
+                "embedding": query_emb,
+                "chunk_keys": chunk_keys,
+                "response": response,
+                "latency": latency,
+                "created_at": time.time()
+            }
+            self._next_key += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+            "size": len(self._entries),
+            "maxsize": self.maxsize
+        }
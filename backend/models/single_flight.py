@@ -0,0 +1,118 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+
+from .metrics import METRICS
+
+METRICS.describe("rag_single_flight_leaders_total", "Calls that ran because no identical call was in flight.")
+METRICS.describe("rag_coalesced_requests_total", "Calls that joined an identical call already in flight.")
+
+
+class _Broadcast:
+    """Items produced so far by one shared stream, replayed to every subscriber."""
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+        self.task = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight async calls.
+
+    The first caller for a key runs the work; callers arriving with the same
+    key before it finishes await the same result (or exception) instead of
+    repeating it. The work is shielded, so a caller that disconnects does not
+    cancel it for the others. Keys are forgotten once the work completes, so
+    nothing is cached beyond the lifetime of the call. stream() does the same
+    for async iterators: late joiners first get every item produced so far.
+    """
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+
+    def _count(self, leader: bool):
+        if leader:
+            self.leaders += 1
+            METRICS.increment("rag_single_flight_leaders_total", stage=self.name)
+        else:
+            self.coalesced += 1
+            METRICS.increment("rag_coalesced_requests_total", stage=self.name)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """Return fn()'s result, sharing one run among concurrent callers with the same key."""
+        if not self.enabled:
+            return await fn()
+        future = self._calls.get(key)
+        self._count(leader=future is None)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(self._calls, key, done))
+        return await asyncio.shield(future)
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Iterate fn()'s items, sharing one iteration among concurrent callers with the same key."""
+        if not self.enabled:
+            async for item in fn():
+                yield item
+            return
+        broadcast = self._streams.get(key)
+        self._count(leader=broadcast is None)
+        if broadcast is None:
+            broadcast = self._streams[key] = _Broadcast()
+            broadcast.task = asyncio.ensure_future(self._pump(broadcast, fn()))
+            broadcast.task.add_done_callback(lambda _: self._forget(self._streams, key, broadcast))
+
+        position = 0
+        while True:
+            async with broadcast.changed:
+                await broadcast.changed.wait_for(lambda: position < len(broadcast.items) or broadcast.done)
+                items: List = broadcast.items[position:]
+                finished = broadcast.done
+            for item in items:
+                yield item
+            position += len(items)
+            if finished and position == len(broadcast.items):
+                if broadcast.error is not None:
+                    raise broadcast.error
+                return
+
+    @staticmethod
+    async def _pump(broadcast: _Broadcast, source: AsyncIterator):
+        try:
+            async for item in source:
+                async with broadcast.changed:
+                    broadcast.items.append(item)
+                    broadcast.changed.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            async with broadcast.changed:
+                broadcast.done = True
+                broadcast.changed.notify_all()
+
+    @staticmethod
+    def _forget(flights: Dict, key: Hashable, flight):
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    def stats(self) -> Dict:
+        total = self.leaders + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_share": self.coalesced / total if total else 0.0,
+            "in_flight": self.in_flight()
+        }
@@ -0,0 +1,29 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Wall-clock durations of named startup phases, in the order they ran."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - start, 3)
+            logger.info("%s: %.3fs", name, self.phases[name])
+
+    def report(self) -> Dict:
+        return {
+            "phases_seconds": dict(self.phases),
+            "elapsed_seconds": round(time.perf_counter() - self.started, 3)
+        }
@@ -0,0 +1,412 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import quantization
+from .courses import course_from_pdf
+from .lexical_index import LexicalIndex, LexicalIndexBuilder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vector_store"
+)
+# Scoring only needs vectors and source info; chunk text is fetched for the winners
+_PROJECTION = {"embedding": 1, "normalized": 1, "pdf_file": 1, "chunk_index": 1, "course": 1}
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length in place; all-zero rows are left as is."""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    embeddings /= norms
+    return embeddings
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k highest scores, best first, using a partial selection."""
+    top_k = min(top_k, scores.shape[0])
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if top_k < scores.shape[0]:
+        candidates = np.argpartition(scores, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def rescored_top_k(similarities: np.ndarray, embeddings: np.ndarray, query_emb: np.ndarray, top_k: int,
+                   shortlist_size: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Shortlist rows from one query's similarity row, then recompute the
+    shortlisted scores directly. A float32 matrix-matrix product can differ
+    from a matrix-vector product in the last bit, so this keeps batched and
+    single-query results identical. With approximate (quantized) similarities
+    pass a larger shortlist_size so the full-precision pass can fix the order.
+    """
+    shortlist = top_k_indices(similarities, shortlist_size or 2 * top_k)
+    scores = embeddings[shortlist].astype(np.float64) @ query_emb.astype(np.float64)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return shortlist[order], scores[order]
+
+
+def mmr_select(query_emb: np.ndarray, candidates: np.ndarray, top_k: int, diversity: float) -> np.ndarray:
+    """
+    Maximal marginal relevance over unit-length candidate rows.
+
+    Picks top_k rows greedily, each maximizing
+    (1 - diversity) * cos(query, row) - diversity * max cos(row, already picked).
+    Only the similarity-matrix rows of picked candidates are ever needed, so
+    each pick computes its own row with one matrix-vector product and the
+    redundancy term is kept as a running maximum; every step is a single
+    vectorized pass over the pool. Returns candidate indices in pick order.
+    """
+    count = candidates.shape[0]
+    top_k = min(top_k, count)
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    relevance = candidates @ query_emb
+    redundancy = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    picks = np.empty(top_k, dtype=np.intp)
+    for i in range(top_k):
+        # The first pick has nothing to be redundant with
+        penalty = redundancy if i else 0.0
+        scores = np.where(available, (1 - diversity) * relevance - diversity * penalty, -np.inf)
+        pick = int(np.argmax(scores))
+        picks[i] = pick
+        available[pick] = False
+        redundancy = np.maximum(redundancy, candidates @ candidates[pick])
+    return picks
+
+
+def fetch_texts(collection, chunk_ids: Sequence) -> Dict:
+    """Fetch chunk text for the given ids in one $in query, keyed by id."""
+    if not chunk_ids:
+        return {}
+    cursor = collection.find({"_id": {"$in": list(chunk_ids)}}, {"chunk_text": 1})
+    return {doc["_id"]: doc["chunk_text"] for doc in cursor}
+
+
+class VectorStore:
+    """
+    Resident copy of the chunk embeddings held in the chunks collection.
+
+    The whole collection is loaded once into a float32 matrix of unit-length
+    rows plus a parallel table of chunk ids and metadata, so cosine similarity
+    against a normalized query is a single matrix-vector product. A background thread then polls the
+    collection and appends chunks inserted since the last poll, so scoring
+    only ever touches local memory. Chunk text is not held resident; hydrate()
+    fetches it for the rows a query actually returns. With lexical=True the
+    text is also read once per chunk to keep a BM25 index of the store.
+    """
+
+    def __init__(self, collection, refresh_interval: float = 30.0, lexical: bool = False):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self._snapshot = (np.empty((0, 0), dtype=np.float32), [], [])
+        # Quantized codes published alongside the vectors, keyed by mode
+        self.codes = {}
+        self.lexical = lexical
+        self._lexical_builder = None
+        # (ids, LexicalIndex) of the snapshot the index was built for
+        self._lexical = None
+        self._last_id = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._poller = None
+
+    def __len__(self) -> int:
+        return len(self._snapshot[1])
+
+    def snapshot(self) -> Tuple[np.ndarray, List, List[Dict]]:
+        """Return (embeddings, ids, metadata) as one consistent view."""
+        return self._snapshot
+
+    def _fetch(self, query: Dict) -> Tuple[np.ndarray, List, List[Dict], List[str]]:
+        projection = {**_PROJECTION, "chunk_text": 1} if self.lexical else _PROJECTION
+        cursor = self.collection.find(query, projection).sort("_id", 1)
+        ids, metadata, embeddings, normalized, texts = [], [], [], [], []
+        for doc in cursor:
+            ids.append(doc["_id"])
+            embeddings.append(doc["embedding"])
+            normalized.append(doc.get("normalized", False))
+            metadata.append({
+                "pdf_file": doc["pdf_file"],
+                "chunk_index": doc["chunk_index"],
+                # Chunks ingested before course tagging fall back to their file name
+                "course": doc.get("course") or course_from_pdf(doc["pdf_file"])
+            })
+            if self.lexical:
+                texts.append(doc["chunk_text"])
+        if not embeddings:
+            return np.empty((0, 0), dtype=np.float32), ids, metadata, texts
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        # Chunks ingested before vectors were stored normalized get scaled once here
+        stale = ~np.asarray(normalized, dtype=bool)
+        if stale.any():
+            embeddings[stale] = normalize_rows(embeddings[stale])
+        return embeddings, ids, metadata, texts
+
+    def _index_texts(self, ids: List, texts: List[str], reset: bool):
+        """Add newly fetched chunk texts to the BM25 index and rebuild it for ids."""
+        if not self.lexical:
+            return
+        if reset or self._lexical_builder is None:
+            self._lexical_builder = LexicalIndexBuilder()
+        for text in texts:
+            self._lexical_builder.add(text)
+        self._lexical = (ids, self._lexical_builder.build())
+
+    def lexical_index(self, snapshot: Tuple[np.ndarray, List, List[Dict]]) -> Optional[LexicalIndex]:
+        """The BM25 index whose rows match this snapshot, or None if there is none."""
+        lexical = self._lexical
+        if lexical is None or lexical[0] is not snapshot[1]:
+            return None
+        return lexical[1]
+
+    def load(self) -> int:
+        """Load every chunk from MongoDB, replacing the resident copy."""
+        embeddings, ids, metadata, texts = self._fetch({})
+        with self._lock:
+            self._index_texts(ids, texts, reset=True)
+            self._snapshot = (embeddings, ids, metadata)
+            self._last_id = ids[-1] if ids else None
+        logger.info("Loaded %d chunks", len(ids))
+        return len(ids)
+
+    def refresh(self) -> int:
+        """
+        Bring the resident copy up to date with the collection.
+
+        The version stamp is the (document count, highest _id) pair. Chunks
+        with an _id above the last one seen are appended; if the count shows
+        that documents were removed the store is reloaded from scratch.
+        Returns the net change in the number of resident chunks.
+        """
+        with self._lock:
+            embeddings, ids, metadata = self._snapshot
+            query = {"_id": {"$gt": self._last_id}} if self._last_id is not None else {}
+            new_embeddings, new_ids, new_metadata, new_texts = self._fetch(query)
+
+            if self.collection.estimated_document_count() != len(ids) + len(new_ids):
+                return self.load() - len(ids)
+            if not new_ids:
+                return 0
+
+            if embeddings.size:
+                new_embeddings = np.vstack([embeddings, new_embeddings])
+            ids = ids + new_ids
+            self._index_texts(ids, new_texts, reset=False)
+            self._snapshot = (new_embeddings, ids, metadata + new_metadata)
+            self._last_id = new_ids[-1]
+        logger.info("Added %d new chunks", len(new_ids))
+        return len(new_ids)
+
+    def courses(self, snapshot: Tuple[np.ndarray, List, List[Dict]]) -> List:
+        """Course tag of every row of a snapshot (None where unknown)."""
+        return [chunk["course"] for chunk in snapshot[2]]
+
+    def chunk_keys(self, snapshot: Tuple[np.ndarray, List, List[Dict]]) -> List[Tuple[str, int]]:
+        """(pdf_file, chunk_index) of every row of a snapshot."""
+        return [(chunk["pdf_file"], chunk["chunk_index"]) for chunk in snapshot[2]]
+
+    def hydrate(self, snapshot: Tuple[np.ndarray, List, List[Dict]], rows: Sequence[int]) -> Dict[int, Dict]:
+        """
+        Return the full chunk (metadata plus chunk_text) for each row of a
+        snapshot, fetched in one bulk lookup. Rows whose chunk was deleted
+        since the snapshot was taken are left out.
+        """
+        _, ids, metadata = snapshot
+        texts = fetch_texts(self.collection, [ids[row] for row in rows])
+        return {
+            row: {**metadata[row], "chunk_text": texts[ids[row]]}
+            for row in rows if ids[row] in texts
+        }
+
+    def _poll(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Refresh failed: %s", e)
+
+    def start_polling(self):
+        """Start the background thread that keeps the store in sync."""
+        if self._poller is None and self.refresh_interval > 0:
+            self._poller = threading.Thread(target=self._poll, name="vector-store-poller", daemon=True)
+            self._poller.start()
+
+    def stop_polling(self):
+        """Stop the background refresh thread."""
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join(timeout=5)
+            self._poller = None
+
+
+class _MappedMetadata:
+    """Read-only chunk metadata whose text lives in a memory-mapped file."""
+
+    def __init__(self, pdf_files: List[str], chunk_indexes: List[int], courses: List,
+                 texts: np.ndarray, offsets: np.ndarray):
+        self.pdf_files = pdf_files
+        self.chunk_indexes = chunk_indexes
+        self.courses = courses
+        self.texts = texts
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.pdf_files)
+
+    def __getitem__(self, idx: int) -> Dict:
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return {
+            "pdf_file": self.pdf_files[idx],
+            "chunk_index": self.chunk_indexes[idx],
+            "course": self.courses[idx],
+            "chunk_text": self.texts[start:end].tobytes().decode("utf-8")
+        }
+
+
+class MappedVectorStore(VectorStore):
+    """
+    Vector store read from the on-disk files written by write_vector_store.
+
+    The embeddings and chunk texts are mapped read-only, so every worker
+    process on the host shares one copy through the page cache. The poller
+    watches the CURRENT pointer and remaps when ingestion publishes a new
+    version.
+    """
+
+    def __init__(self, store_dir: str = DEFAULT_STORE_DIR, refresh_interval: float = 30.0):
+        super().__init__(None, refresh_interval)
+        self.store_dir = store_dir
+        self.version = None
+
+    def _current_version(self) -> str:
+        with open(os.path.join(self.store_dir, "CURRENT")) as f:
+            return f.read().strip()
+
+    def load(self) -> int:
+        """Map the version CURRENT points at, replacing the resident view."""
+        version = self._current_version()
+        version_dir = os.path.join(self.store_dir, version)
+        with open(os.path.join(version_dir, "meta.json")) as f:
+            meta = json.load(f)
+        embeddings = np.load(os.path.join(version_dir, "embeddings.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(version_dir, "text_offsets.npy"), mmap_mode="r")
+        texts_path = os.path.join(version_dir, "texts.bin")
+        if os.path.getsize(texts_path):
+            texts = np.memmap(texts_path, dtype=np.uint8, mode="r")
+        else:
+            texts = np.empty(0, dtype=np.uint8)
+        courses = meta.get("course") or [course_from_pdf(pdf_file) for pdf_file in meta["pdf_file"]]
+        metadata = _MappedMetadata(meta["pdf_file"], meta["chunk_index"], courses, texts, offsets)
+        codes = quantization.load_saved(version_dir)
+        try:
+            lexical = (meta["ids"], LexicalIndex.load(version_dir))
+        except FileNotFoundError:
+            lexical = None
+        with self._lock:
+            self._snapshot = (embeddings, meta["ids"], metadata)
+            self.codes = codes
+            self._lexical = lexical
+            self.version = version
+        logger.info("Mapped %d chunks from version %s", meta["count"], version)
+        return meta["count"]
+
+    def courses(self, snapshot: Tuple[np.ndarray, List, List[Dict]]) -> List:
+        return snapshot[2].courses
+
+    def chunk_keys(self, snapshot: Tuple[np.ndarray, List, List[Dict]]) -> List[Tuple[str, int]]:
+        metadata = snapshot[2]
+        return list(zip(metadata.pdf_files, metadata.chunk_indexes))
+
+    def hydrate(self, snapshot: Tuple[np.ndarray, List, List[Dict]], rows: Sequence[int]) -> Dict[int, Dict]:
+        """Read the chunk text for each row from the mapped local text store."""
+        metadata = snapshot[2]
+        return {row: metadata[row] for row in rows}
+
+    def refresh(self) -> int:
+        """Remap if ingestion has published a new version since the last load."""
+        with self._lock:
+            if self._current_version() == self.version:
+                return 0
+            previous = len(self)
+            return self.load() - previous
+
+
+def write_vector_store(embeddings: np.ndarray, ids: Sequence, metadata: Sequence[Dict],
+                       store_dir: str = DEFAULT_STORE_DIR, keep_versions: int = 2,
+                       quantize: Sequence[str] = ("int8", "binary")) -> str:
+    """
+    Publish a new on-disk version of the vector store.
+
+    Writes a contiguous float32 embeddings.npy, the chunk texts as one UTF-8
+    blob with an offsets array, a meta.json sidecar with ids and source info,
+    the quantized codes for each mode in quantize, and a BM25 index over the
+    chunk texts into a fresh version directory. Rows are grouped by course, so each course shard is one
+    contiguous slice of the mapped matrix. The CURRENT pointer is then swapped
+    atomically, so readers only ever see a complete version. Returns the
+    new version name.
+    """
+    version = str(time.time_ns())
+    version_dir = os.path.join(store_dir, version)
+    os.makedirs(version_dir)
+
+    courses = [chunk.get("course") or course_from_pdf(chunk["pdf_file"]) for chunk in metadata]
+    order = sorted(range(len(courses)), key=lambda row: courses[row] or "")
+    ids = [ids[row] for row in order]
+    metadata = [metadata[row] for row in order]
+    courses = [courses[row] for row in order]
+    embeddings = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32)[order], dtype=np.float32)
+    np.save(os.path.join(version_dir, "embeddings.npy"), embeddings)
+    if len(embeddings):
+        for mode in quantize:
+            quantization.encode(embeddings, mode).save(version_dir)
+
+    encoded = [chunk["chunk_text"].encode("utf-8") for chunk in metadata]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in encoded])
+    np.save(os.path.join(version_dir, "text_offsets.npy"), offsets)
+    with open(os.path.join(version_dir, "texts.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+
+    builder = LexicalIndexBuilder()
+    for chunk in metadata:
+        builder.add(chunk["chunk_text"])
+    builder.build().save(version_dir)
+
+    with open(os.path.join(version_dir, "meta.json"), "w") as f:
+        json.dump({
+            "version": version,
+            "count": len(encoded),
+            "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+            "ids": [str(i) for i in ids],
+            "pdf_file": [chunk["pdf_file"] for chunk in metadata],
+            "chunk_index": [chunk["chunk_index"] for chunk in metadata],
+            "course": courses
+        }, f)
+
+    pointer = os.path.join(store_dir, "CURRENT")
+    with open(pointer + ".tmp", "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer + ".tmp", pointer)
+
+    # Drop old versions; readers still mapping one keep their open pages
+    versions = sorted(
+        name for name in os.listdir(store_dir)
+        if os.path.isdir(os.path.join(store_dir, name))
+    )
+    for name in versions[:-keep_versions]:
+        shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+    return version
@@ -0,0 +1,34 @@
+from typing import Dict, Iterable, List, Tuple
+
+ChunkKey = Tuple[str, int]
+
+
+def chunk_key(chunk: Dict) -> ChunkKey:
+    """A chunk's stable identity across store reloads: its PDF and position in it."""
+    return chunk["pdf_file"], int(chunk["chunk_index"])
+
+
+def neighbour_keys(working_set: List[Dict], distance: int) -> Iterable[ChunkKey]:
+    """Keys of the chunks up to distance positions either side of each working-set chunk."""
+    for entry in working_set:
+        pdf_file, chunk_index = chunk_key(entry)
+        for offset in range(-distance, distance + 1):
+            if offset and chunk_index + offset >= 0:
+                yield pdf_file, chunk_index + offset
+
+
+def merge_working_set(working_set: List[Dict], chunks: List[Dict], max_size: int) -> List[Dict]:
+    """
+    Add newly retrieved chunks to a guide's working set.
+
+    Entries are {"pdf_file", "chunk_index", "score"}, where score is the best
+    similarity the chunk has had for any question in the guide. The highest
+    scoring max_size entries are kept, best first.
+    """
+    merged = {chunk_key(entry): float(entry["score"]) for entry in working_set}
+    for chunk in chunks:
+        key = chunk_key(chunk)
+        merged[key] = max(merged.get(key, float("-inf")), float(chunk["score"]))
+    best = sorted(merged.items(), key=lambda item: item[1], reverse=True)[:max_size]
+    return [{"pdf_file": pdf_file, "chunk_index": chunk_index, "score": score}
+            for (pdf_file, chunk_index), score in best]
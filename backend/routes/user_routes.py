@@ -1,15 +1,37 @@
+import os
 from typing import Optional
 from bson import ObjectId  # Import to check and convert ObjectId
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request
 from models.user import User
 from db import users_collection
 from datetime import datetime
 from pydantic import BaseModel, Field
 from db import study_guide_collection
 from db import serialize_mongo_document
-from models.generate_guide import generate_study_guide
+from models.conversation_compactor import ConversationCompactor
+from models.generate_guide import STUDY_GUIDE_PARAMS, study_guide_llm
 router = APIRouter()
 
+_compactor = None
+
+
+def get_compactor() -> ConversationCompactor:
+    """
+    The compactor for follow-up prompts, which carry a rolling summary plus
+    the latest turns, not the whole history. Built on first use, so its
+    gateway and tokenizer do not load at import and slow down startup.
+    """
+    global _compactor
+    if _compactor is None:
+        _compactor = ConversationCompactor(
+            users_collection,
+            study_guide_llm(),
+            recent_turns=int(os.getenv("GUIDE_RECENT_TURNS", "4")),
+            token_budget=int(os.getenv("GUIDE_PROMPT_TOKEN_BUDGET", "3000")),
+            summary_tokens=int(os.getenv("GUIDE_SUMMARY_TOKENS", "400"))
+        )
+    return _compactor
+
 class StudyGuideRequest(BaseModel):
     # email: str
     # user_prompt: str
@@ -113,15 +135,18 @@ class UpdateGuideRequest(BaseModel):
     email: str
     study_guide_id: str
     user_prompt: str
+    course: Optional[str] = None
 
 @router.post("/update-guide")
-async def update_study_guide(request: UpdateGuideRequest):
+async def update_study_guide(request: UpdateGuideRequest, http_request: Request, background_tasks: BackgroundTasks):
     """Handles follow-up questions and appends responses to an existing study guide session."""
     try:
         # Extract data from the request body
         email = request.email
         study_guide_id = request.study_guide_id
         user_prompt = request.user_prompt
+        # 503 while the RAG pipeline is still loading
+        rag = http_request.app.state.require_rag()
 
         # Find the study guide
         guide = await users_collection.find_one(
@@ -131,27 +156,33 @@ async def update_study_guide(request: UpdateGuideRequest):
         if not guide:
             raise HTTPException(status_code=404, detail="Study guide not found")
 
-        # Retrieve full conversation history
-        conversation_history = next(
-            (g["conversation"] for g in guide["study_guides"] if g["_id"] == study_guide_id),
-            []
-        )
+        study_guide = next((g for g in guide["study_guides"] if g["_id"] == study_guide_id), {})
 
-        # Format conversation as context for AI
-        context = "\n".join([f"User: {msg['user_prompt']}\nAI: {msg['response']}" for msg in conversation_history])
-        full_prompt = f"{context}\nUser: {user_prompt}\nAI:"
+        # Summary of older turns plus the latest ones, within a fixed token budget
+        compactor = get_compactor()
+        full_prompt = compactor.build_prompt(study_guide, user_prompt)
 
-        # Generate a response in context of the full conversation
-        new_response = generate_study_guide(full_prompt)
+        # Retrieve for the new question from the guide's working set first, answer with the conversation
+        new_response, working_set = await rag.generate_with_working_set(
+            user_prompt, request.course, study_guide.get("working_set", []), full_prompt,
+            llm=study_guide_llm(), llm_params=STUDY_GUIDE_PARAMS
+        )
 
         # Append new Q&A to conversation history
         await users_collection.update_one(
             {"email": email, "study_guides._id": study_guide_id},
-            {"$push": {"study_guides.$.conversation": {"user_prompt": user_prompt, "response": new_response}}}
+            {
+                "$push": {"study_guides.$.conversation": {"user_prompt": user_prompt, "response": new_response}},
+                "$set": {"study_guides.$.working_set": working_set}
+            }
         )
+        # Fold turns that left the recent window into the summary after responding
+        background_tasks.add_task(compactor.refresh, email, study_guide_id)
 
         return {"message": "Follow-up response added", "response": new_response}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from models.batch_encoder import BatchingEncoder
+
+
+class FakeModel:
+    """Encodes each text as [len(text), 0], optionally waiting for a gate first."""
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.entered = threading.Event()
+        self.batches = []
+
+    def encode(self, texts, normalize_embeddings=True):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait()
+        self.batches.append(list(texts))
+        return np.array([[len(text), 0] for text in texts], dtype=np.float64)
+
+
+def test_each_caller_gets_its_own_rows():
+    encoder = BatchingEncoder(FakeModel(), max_wait_ms=20)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(encoder.encode, [["a"], ["bb", "ccc"], ["dddd"]]))
+    encoder.close()
+
+    assert [result[:, 0].tolist() for result in results] == [[1], [2, 3], [4]]
+    assert results[0].dtype == np.float32
+
+
+def test_encode_fails_fast_after_close():
+    encoder = BatchingEncoder(FakeModel())
+    encoder.close()
+
+    with ThreadPoolExecutor(1) as pool, pytest.raises(RuntimeError, match="closed"):
+        pool.submit(encoder.encode, ["late"]).result(timeout=5)
+    encoder.close()
+
+
+def test_close_serves_requests_already_queued():
+    gate = threading.Event()
+    model = FakeModel(gate)
+    encoder = BatchingEncoder(model, max_batch_size=2, max_wait_ms=0)
+    with ThreadPoolExecutor(4) as pool:
+        # The worker is stuck on the first batch while the others queue
+        first = pool.submit(encoder.encode, ["a"])
+        assert model.entered.wait(timeout=5)
+        queued = [pool.submit(encoder.encode, texts) for texts in (["bb", "cc"], ["d"])]
+        while encoder.stats()["queue_depth"] < 2:
+            gate.wait(0.001)
+        closing = pool.submit(encoder.close)
+        gate.set()
+        closing.result(timeout=5)
+        results = [future.result(timeout=5)[:, 0].tolist() for future in [first, *queued]]
+
+    assert sorted(results) == [[1], [1], [2, 2]]
+    assert sum(len(batch) for batch in model.batches) == 4
@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from models import conversation_compactor
+from models.conversation_compactor import ConversationCompactor
+
+
+class WordEncoding:
+    """One token per word, so budgets are easy to reason about without tiktoken's downloads."""
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class FakeCollection:
+    """Holds one user's guide and applies the compactor's summary updates to it."""
+
+    def __init__(self, guide):
+        self.guide = guide
+
+    async def find_one(self, query, projection=None):
+        return {"study_guides": [dict(self.guide)]}
+
+    async def update_one(self, query, update):
+        self.guide["summary"] = update["$set"]["study_guides.$.summary"]
+        return SimpleNamespace(modified_count=1)
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = []
+
+    async def achat(self, messages, **params):
+        self.calls.append(messages[-1]["content"])
+        content = f"summary {len(self.calls)}"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture(autouse=True)
+def word_encoding(monkeypatch):
+    monkeypatch.setattr(conversation_compactor.tiktoken, "encoding_for_model", lambda model: WordEncoding())
+
+
+def conversation(turns):
+    return [{"user_prompt": f"question {i}", "response": f"answer {i}"} for i in range(turns)]
+
+
+def compactor_for(guide, **kwargs):
+    llm = FakeLLM()
+    return ConversationCompactor(FakeCollection(guide), llm, recent_turns=4, **kwargs), llm
+
+
+def test_refresh_leaves_a_conversation_shorter_than_the_recent_window():
+    guide = {"_id": "g", "conversation": conversation(3)}
+    compactor, llm = compactor_for(guide)
+
+    asyncio.run(compactor.refresh("a@b.c", "g"))
+
+    assert llm.calls == []
+    assert "summary" not in guide
+    prompt = compactor.build_prompt(guide, "next")
+    assert all(f"question {i}" in prompt for i in range(3))
+
+
+def test_refresh_summarizes_turns_older_than_the_recent_window():
+    guide = {"_id": "g", "conversation": conversation(6)}
+    compactor, llm = compactor_for(guide)
+
+    asyncio.run(compactor.refresh("a@b.c", "g"))
+
+    assert guide["summary"] == {"text": "summary 1", "turns": 2}
+    assert "question 1" in llm.calls[0] and "question 2" not in llm.calls[0]
+    assert compactor.stats()["summarized_turns"] == 2
+    prompt = compactor.build_prompt(guide, "next")
+    assert prompt.startswith("Summary of the earlier conversation:\nsummary 1")
+    assert "question 1" not in prompt
+    assert all(f"question {i}" in prompt for i in range(2, 6))
+    assert prompt.endswith("User: next\nAI:")
+
+
+def test_build_prompt_keeps_the_newest_turns_that_fit():
+    guide = {"_id": "g", "conversation": conversation(6)}
+    # Each formatted turn is 6 words and the question 3, so two turns fit
+    compactor, _ = compactor_for(guide, token_budget=15)
+
+    prompt = compactor.build_prompt(guide, "next")
+
+    assert prompt == "User: question 4\nAI: answer 4\nUser: question 5\nAI: answer 5\nUser: next\nAI:"
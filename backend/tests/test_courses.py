@@ -0,0 +1,51 @@
+import pytest
+
+from models.courses import course_from_pdf, infer_course
+
+
+@pytest.mark.parametrize("prompt", [
+    "French Revolution causes",
+    "Spanish-American War",
+    "Latin America independence",
+    "Japanese internment WWII",
+    "Chinese Exclusion Act",
+    "government shutdown history",
+    "Drawing on the documents, explain the causes of the Civil War",
+    "Environmental impact of the Industrial Revolution",
+    "Role of music in the Harlem Renaissance",
+    "Geography of the Fertile Crescent and early civilizations",
+])
+def test_history_topics_are_not_routed_to_a_course(prompt):
+    assert infer_course(prompt) is None
+
+
+@pytest.mark.parametrize("prompt, course", [
+    ("APUSH DBQ tips", "united-states-history"),
+    ("AP Bio cell respiration", "biology"),
+    ("AP French subjunctive", "french-language-and-culture"),
+    ("french language listening practice", "french-language-and-culture"),
+    ("AP Gov checks and balances", "united-states-government-and-politics"),
+    ("AP Micro elasticity", "microeconomics"),
+    ("AP Drawing portfolio", "drawing"),
+    ("AP Music Theory cadences", "music-theory"),
+    ("AP Human Geography migration", "human-geography"),
+    ("AP Psych memory", "psychology"),
+    ("APES nitrogen cycle", "environmental-science"),
+])
+def test_course_names_are_inferred(prompt, course):
+    assert infer_course(prompt) == course
+
+
+@pytest.mark.parametrize("pdf_file, course", [
+    ("ap23-frq-latin.pdf", "latin"),
+    ("ap22-frq-french.pdf", "french-language-and-culture"),
+    ("ap19-frq-us-gov.pdf", "united-states-government-and-politics"),
+    ("ap23-frq-spanish-literature.pdf", "spanish-literature-and-culture"),
+    ("ap23-frq-drawing.pdf", "drawing"),
+    ("ap22-frq-music.pdf", "music-theory"),
+    ("ap21-frq-hug.pdf", "human-geography"),
+    ("ap23-frq-psych.pdf", "psychology"),
+    ("ap19-frq-enviro.pdf", "environmental-science"),
+])
+def test_pdf_names_keep_bare_course_words(pdf_file, course):
+    assert course_from_pdf(pdf_file) == course
@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from models.hedged_llm import DeadlineExceeded, HedgedLLM
+
+
+def chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+def completion(model):
+    return SimpleNamespace(model=model)
+
+
+class FakeGateway:
+    """Answers after delays[model] seconds, or the next of delays[model] when it is a list."""
+
+    max_concurrency = 4
+
+    def __init__(self, delays, p95=None):
+        self.delays = delays
+        self.p95 = p95
+        self.requests = []
+        self.closed_streams = 0
+
+    def _delay(self, model):
+        delay = self.delays[model]
+        return delay.pop(0) if isinstance(delay, list) else delay
+
+    def latency_percentile(self, model, percentile):
+        return self.p95
+
+    async def achat(self, messages, **params):
+        self.requests.append(params["model"])
+        await asyncio.sleep(self._delay(params["model"]))
+        return completion(params["model"])
+
+    async def astream(self, messages, **params):
+        self.requests.append(params["model"])
+        try:
+            yield chunk(None)
+            await asyncio.sleep(self._delay(params["model"]))
+            for word in (params["model"], " answer"):
+                yield chunk(word)
+        finally:
+            self.closed_streams += 1
+
+
+async def collect(stream):
+    return "".join([event.choices[0].delta.content or "" async for event in stream])
+
+
+def test_stream_falls_back_when_first_token_misses_deadline():
+    gateway = FakeGateway({"slow": 5.0, "fast": 0.0})
+    llm = HedgedLLM(gateway, deadline=0.05, fallback_model="fast")
+
+    assert asyncio.run(collect(llm.astream([], model="slow"))) == "fast answer"
+    assert gateway.requests == ["slow", "fast"]
+    assert gateway.closed_streams == 2
+    assert llm.stats()["fallbacks"] == 1
+
+
+def test_stream_within_deadline_is_passed_through():
+    gateway = FakeGateway({"slow": 0.0})
+    llm = HedgedLLM(gateway, deadline=1.0, fallback_model="fast")
+
+    assert asyncio.run(collect(llm.astream([], model="slow"))) == "slow answer"
+    assert gateway.requests == ["slow"]
+    assert llm.stats()["deadline_exceeded"] == 0
+
+
+def test_stream_without_fallback_fails_at_deadline():
+    llm = HedgedLLM(FakeGateway({"slow": 5.0}), deadline=0.05)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(collect(llm.astream([], model="slow")))
+
+
+def test_hedge_answers_when_first_request_is_slow():
+    gateway = FakeGateway({"gpt-4": [5.0, 0.0]}, p95=0.02)
+    llm = HedgedLLM(gateway, hedging=True, min_hedge_delay=0.0, max_hedge_rate=1.0)
+
+    assert asyncio.run(llm.achat([], model="gpt-4")).model == "gpt-4"
+    stats = llm.stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+
+
+def test_no_hedge_over_budget():
+    gateway = FakeGateway({"gpt-4": 0.05}, p95=0.01)
+    llm = HedgedLLM(gateway, hedging=True, min_hedge_delay=0.0, max_hedge_rate=0.0)
+
+    asyncio.run(llm.achat([], model="gpt-4"))
+    assert gateway.requests == ["gpt-4"]
+
+
+def test_achat_falls_back_at_deadline():
+    gateway = FakeGateway({"slow": 5.0, "fast": 0.0})
+    llm = HedgedLLM(gateway, deadline=0.05, fallback_model="fast")
+
+    assert asyncio.run(llm.achat([], model="slow")).model == "fast"
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from models.lexical_index import LexicalIndexBuilder
+
+
+def build(texts):
+    builder = LexicalIndexBuilder()
+    for text in texts:
+        builder.add(text)
+    return builder.build()
+
+
+def exhaustive(index, query, top_k, rows=None):
+    """Top k by scoring every row, for comparison with the pruned search."""
+    rows = np.arange(len(index)) if rows is None else rows
+    scores = index.score_rows(query, rows)
+    order = np.argsort(-scores, kind="stable")
+    order = order[scores[order] > 0][:top_k]
+    return rows[order], scores[order]
+
+
+def test_search_prunes_common_terms_without_changing_the_top_k(monkeypatch):
+    texts = ["court ruling on the case"] * 200
+    texts[17] = "marbury madison marbury court"
+    texts[120] = "marbury v madison judicial review"
+    index = build(texts)
+    scored = {}
+    contributions = index._contributions
+
+    def spy(term_id, docs, tfs):
+        scored[index.terms[term_id]] = len(docs)
+        return contributions(term_id, docs, tfs)
+
+    monkeypatch.setattr(index, "_contributions", spy)
+    rows, scores = index.search("marbury court", 2)
+
+    # After "marbury", "court" cannot lift an unseen row into the top 2, so only the rows in play are scored
+    assert scored == {"marbury": 2, "court": 1}
+    assert rows.tolist() == [17, 120]
+    np.testing.assert_allclose(scores, index.score_rows("marbury court", rows), rtol=1e-6)
+
+
+@pytest.mark.parametrize("restricted", [False, True])
+def test_search_matches_exhaustive_scoring(restricted):
+    rng = np.random.default_rng(0)
+    vocab = [f"term{i}" for i in range(60)]
+    # Zipf-like term frequencies give a few long postings lists and many short ones
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    texts = [" ".join(rng.choice(vocab, size=rng.integers(5, 40), p=weights / weights.sum())) for _ in range(500)]
+    index = build(texts)
+    rows = np.sort(rng.choice(len(texts), size=150, replace=False)) if restricted else None
+
+    for _ in range(20):
+        query = " ".join(rng.choice(vocab, size=3, replace=False))
+        found, scores = index.search(query, 10, rows)
+        expected, expected_scores = exhaustive(index, query, 10, rows)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+        assert set(found.tolist()) <= set(range(len(texts)) if rows is None else rows.tolist())
@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+
+from models.single_flight import SingleFlight
+
+
+class Work:
+    """An async call that counts its runs and finishes when released."""
+
+    def __init__(self, result="answer", error=None):
+        self.result = result
+        self.error = error
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_callers_share_the_leaders_call():
+    async def main():
+        flight, work = SingleFlight("test"), Work()
+        leader = asyncio.ensure_future(flight.do("key", work))
+        follower = asyncio.ensure_future(flight.do("key", work))
+        other = asyncio.ensure_future(flight.do("other", work))
+        await asyncio.sleep(0)
+        assert flight.in_flight() == 2
+        work.release.set()
+        assert await asyncio.gather(leader, follower, other) == ["answer"] * 3
+        return flight, work
+
+    flight, work = asyncio.run(main())
+    assert work.runs == 2
+    assert (flight.leaders, flight.coalesced) == (2, 1)
+    assert flight.in_flight() == 0
+
+
+def test_key_is_forgotten_once_the_call_completes():
+    async def main():
+        flight, work = SingleFlight("test"), Work()
+        work.release.set()
+        await flight.do("key", work)
+        await flight.do("key", work)
+        return work
+
+    assert asyncio.run(main()).runs == 2
+
+
+def test_leader_failure_reaches_every_caller():
+    async def main():
+        flight, work = SingleFlight("test"), Work(error=ValueError("boom"))
+        callers = [asyncio.ensure_future(flight.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        work.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        # A later call runs again instead of replaying the failure
+        work.error = None
+        return results, await flight.do("key", work), work
+
+    results, retried, work = asyncio.run(main())
+    assert [str(result) for result in results] == ["boom"] * 3
+    assert all(isinstance(result, ValueError) for result in results)
+    assert retried == "answer"
+    assert work.runs == 2
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def main():
+        flight, work = SingleFlight("test"), Work()
+        leader = asyncio.ensure_future(flight.do("key", work))
+        follower = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        work.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "answer"
+
+
+def test_disabled_runs_every_call():
+    async def main():
+        flight, work = SingleFlight("test", enabled=False), Work()
+        work.release.set()
+        await asyncio.gather(flight.do("key", work), flight.do("key", work))
+        return flight, work
+
+    flight, work = asyncio.run(main())
+    assert work.runs == 2
+    assert (flight.leaders, flight.coalesced) == (0, 0)
+
+
+class Tokens:
+    """An async iterator factory that yields each token once its gate is opened."""
+
+    def __init__(self, tokens, error=None):
+        self.tokens = tokens
+        self.error = error
+        self.gates = [asyncio.Event() for _ in tokens]
+        self.runs = 0
+
+    async def _iterate(self):
+        for token, gate in zip(self.tokens, self.gates):
+            await gate.wait()
+            yield token
+        if self.error is not None:
+            raise self.error
+
+    def __call__(self):
+        self.runs += 1
+        return self._iterate()
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_late_joiner_receives_the_tokens_already_sent():
+    async def main():
+        flight, tokens = SingleFlight("test"), Tokens(["a", "b", "c"])
+        first = asyncio.ensure_future(collect(flight.stream("key", tokens)))
+        tokens.gates[0].set()
+        tokens.gates[1].set()
+        await asyncio.sleep(0.01)
+        late = asyncio.ensure_future(collect(flight.stream("key", tokens)))
+        await asyncio.sleep(0.01)
+        tokens.gates[2].set()
+        return await first, await late, flight, tokens
+
+    first, late, flight, tokens = asyncio.run(main())
+    assert first == late == ["a", "b", "c"]
+    assert tokens.runs == 1
+    assert (flight.leaders, flight.coalesced) == (1, 1)
+    assert flight.in_flight() == 0
+
+
+def test_stream_failure_reaches_every_subscriber_after_its_tokens():
+    async def main():
+        flight, tokens = SingleFlight("test"), Tokens(["a"], error=RuntimeError("dropped"))
+        received = [[], []]
+
+        async def subscribe(into):
+            async for item in flight.stream("key", tokens):
+                into.append(item)
+
+        subscribers = [asyncio.ensure_future(subscribe(into)) for into in received]
+        await asyncio.sleep(0)
+        tokens.gates[0].set()
+        return await asyncio.gather(*subscribers, return_exceptions=True), received
+
+    results, received = asyncio.run(main())
+    assert [str(result) for result in results] == ["dropped", "dropped"]
+    assert received == [["a"], ["a"]]
@@ -2,9 +2,11 @@ import os
 import sys
 import csv
 import json
+# Re-runs with unchanged inputs reuse every stored completion; LLM_CACHE_MODE=read_only keeps the cache as is
+os.environ.setdefault("LLM_CACHE_MODE", "read_write")
 from sentence_transformers import SentenceTransformer
-from scraper import retrieve_relevant_chunks, generate_rag_response
-import openai
+from scraper.store_pdf_mongo import retrieve_many, generate_rag_response
+from backend.models.llm_gateway import get_gateway
 
 # -------------------- Configuration --------------------
 # List of study guide prompts to evaluate (150 AP-related queries)
@@ -256,7 +258,7 @@ def evaluate_response_with_rubric(answer: str):
     """
     prompt = RUBRIC_PROMPT_TEMPLATE + "\n\nAnswer:\n" + answer
     try:
-        completion = openai.ChatCompletion.create(
+        completion = get_gateway().chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful rubric grader."},
@@ -274,7 +276,7 @@ def evaluate_response_with_rubric(answer: str):
 def check_hallucinations(answer: str):
     prompt = HALLUCINATION_PROMPT_TEMPLATE + "\n\nContent:\n" + answer
     try:
-        completion = openai.ChatCompletion.create(
+        completion = get_gateway().chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": "You are a factuality oracle."},
@@ -297,7 +299,6 @@ def main():
     if not api_key:
         print("Error: OPENAI_API_KEY environment variable not set.")
         sys.exit(1)
-    openai.api_key = api_key
 
     # Load embedding model
     print("Loading embedding model...")
@@ -307,11 +308,14 @@ def main():
     rubric_results = []
     hallucination_results = []
 
+    # Retrieve context for every query in one batched pass
+    print("Retrieving chunks for all queries...")
+    all_chunks = retrieve_many(QUERIES, model, TOP_K, SIMILARITY_THRESHOLD)
+
     # Iterate over queries
-    for idx, query in enumerate(QUERIES, start=1):
+    for idx, (query, chunks) in enumerate(zip(QUERIES, all_chunks), start=1):
         print(f"Processing {idx}/{len(QUERIES)}: {query}")
-        # RAG retrieval & generation
-        chunks = retrieve_relevant_chunks(query, model, TOP_K, SIMILARITY_THRESHOLD)
+        # RAG generation
         answer = generate_rag_response(query, chunks)
 
         # Rubric evaluation
@@ -346,6 +350,7 @@ def main():
         for row in hallucination_results:
             writer.writerow(row)
     print(f"Hallucination results saved to {hall_file}")
+    print(f"LLM completion cache: {get_gateway().stats()['cache']}")
 
 
 if __name__ == "__main__":
@@ -47,24 +47,51 @@ function InputForm({ onStudyGuideGenerated, user, selectedStudyGuide, setSelecte
     setIsLoading(true);
     
     try {
-      const response = await fetch("http://localhost:8000/generate-guide", {
+      const response = await fetch("http://localhost:8000/generate-guide/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ email: user.email, user_prompt: topic }),
       });
 
-      if (response.ok) {
-        const data = await response.json();
-        setConversation(data.study_guide.conversation); // This will include both prompt and response
-        setSelectedStudyGuide(data.study_guide);
-        if (data.study_guide.conversation.length > 0) {
-          startTypingEffect(data.study_guide.conversation[0].response || "");
-        }
-        if (onStudyGuideGenerated) {
-          onStudyGuideGenerated(data.study_guide.content, topic);
-        }
-      } else {
+      if (!response.ok || !response.body) {
         setError("Failed to generate study guide. Please try again.");
+        return;
+      }
+
+      // Read server-sent events: retrieval metadata, then tokens, then "done"
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let partial = "";
+      let finished = false;
+      while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const raw of events) {
+          if (!raw.startsWith("data: ")) continue;
+          const event = JSON.parse(raw.slice(6));
+          if (event.type === "token") {
+            partial += event.content;
+            setConversation([{ user_prompt: topic, response: partial }]);
+          } else if (event.type === "done") {
+            finished = true;
+            setConversation(event.study_guide.conversation);
+            setSelectedStudyGuide(event.study_guide);
+            if (onStudyGuideGenerated) {
+              onStudyGuideGenerated(event.study_guide.content, topic);
+            }
+          } else if (event.type === "error") {
+            finished = true;
+            setError(event.detail);
+          }
+        }
+      }
+      if (!finished) {
+        // The stream closed without a "done" or "error" event
+        setError("The response was cut off. Please try again.");
       }
     } catch (err) {
       console.error("Fetch error:", err);
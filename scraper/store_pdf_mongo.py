@@ -1,27 +1,40 @@
 import os
+import sys
 from dotenv import load_dotenv
 import numpy as np
 import json
 import PyPDF2
 from sentence_transformers import SentenceTransformer
 from pymongo import MongoClient
-from openai import OpenAI
+
+# Run as a script (python scraper/store_pdf_mongo.py, or via scraper/updated_main.py) only the
+# scraper directory is on sys.path; the backend package is imported from the repo root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from backend.models.vector_store import DEFAULT_STORE_DIR, fetch_texts, normalize_rows, rescored_top_k, top_k_indices, write_vector_store
+from backend.models.ann_index import AnnIndex, DEFAULT_INDEX_PATH, MIN_SHARD_INDEX_SIZE, shard_index_path
+from backend.models.context_builder import ContextBuilder
+from backend.models.courses import rows_by_course, tag_course
+from backend.models.llm_gateway import get_gateway
 
 # Load .env from backend directory
-load_dotenv("backend/.env")
+load_dotenv(os.path.join(REPO_ROOT, "backend", ".env"))
 
 # ─── MongoDB Atlas Setup ─────────────────────────────────────────────────────
 # Expects your Atlas connection string in the MONGODB_URI environment variable:
 #   export MONGODB_URI="mongodb+srv://<user>:<pass>@cluster0.xyz.mongodb.net/?retryWrites=true&w=majority"
 MONGO_URI = os.getenv("MONGO_URI") 
-OpenAI.api_key = os.getenv("OPENAI_API_KEY")
 if not MONGO_URI:
     raise RuntimeError("Set the MONGODB_URI environment variable to your Atlas URI")
-ai_client = OpenAI()
+# Pooled, rate-limited LLM client, configured by the same LLM_* variables as the backend
+llm = get_gateway(os.getenv("OPENAI_API_KEY"))
 # Create a single, global client & collection reference
 client = MongoClient(MONGO_URI)  # Removed tls=True since it's already in the URI
 db = client["Tootur"]  # Changed from pdf_chunks_db to Tootur
 chunks_coll = db["chunks"]  # Collection name remains the same
+context_builder = ContextBuilder(token_budget=int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "2000")))
 
 
 def extract_text_from_pdf(pdf_path):
@@ -82,13 +95,20 @@ def index_pdfs(pdf_directory, model, chunk_size=500):
     Process each PDF in the directory:
     1. Extract text.
     2. Chunk the text.
-    3. Generate an embedding for each chunk.
-    4. Collect embeddings and metadata.
+    3. Generate a unit-length embedding for each chunk.
+    4. Tag each chunk with its AP course, from the page the PDF was
+       downloaded from (sources.json) or else the file name.
+    5. Collect embeddings and metadata.
     
     Returns:
         None, metadata_list
     """
     metadata = []
+    sources = {}
+    sources_path = os.path.join(pdf_directory, "sources.json")
+    if os.path.exists(sources_path):
+        with open(sources_path) as f:
+            sources = json.load(f)
 
     for filename in os.listdir(pdf_directory):
         if filename.lower().endswith(".pdf"):
@@ -98,14 +118,17 @@ def index_pdfs(pdf_directory, model, chunk_size=500):
             if not text.strip():
                 continue
 
+            course = tag_course(filename, sources.get(filename))
             chunks = chunk_text(text, max_length=chunk_size)
             for i, chunk in enumerate(chunks):
-                embedding = model.encode(chunk)
+                embedding = model.encode(chunk, normalize_embeddings=True)
                 metadata.append({
                     'pdf_file': filename,
                     'chunk_index': i,
+                    'course': course,
                     'chunk_text': chunk,
-                    'embedding': embedding.tolist()
+                    'embedding': embedding.tolist(),
+                    'normalized': True
                 })
 
     if metadata:
@@ -146,48 +169,144 @@ def load_index_and_metadata(index_file="faiss_index.index", metadata_file="metad
     return None, docs
 
 
-def retrieve_relevant_chunks(query, model, top_k=5, similarity_threshold=0.3):
+def backfill_courses():
     """
-    Retrieve the top_k most similar chunks for a given query, filtered by a similarity threshold.
+    Tag chunks stored before course tagging with the course their file name
+    names, and index the course field for shard lookups.
     """
-    query_emb = model.encode(query).astype(np.float32)
-
-    # Load all vectors and metadata from MongoDB
-    cursor = chunks_coll.find({}, {"embedding": 1, "pdf_file": 1, "chunk_index": 1, "chunk_text": 1})
-    metadata, embeddings = [], []
+    tagged = 0
+    for pdf_file in chunks_coll.distinct("pdf_file", {"course": {"$exists": False}}):
+        course = tag_course(pdf_file)
+        if course:
+            tagged += chunks_coll.update_many(
+                {"pdf_file": pdf_file, "course": {"$exists": False}}, {"$set": {"course": course}}
+            ).modified_count
+    chunks_coll.create_index("course")
+    print(f"Tagged {tagged} existing chunks with their course.")
+
+
+def load_chunk_vectors(with_text=True, course=None):
+    """
+    Load every chunk's id, unit-length embedding and metadata from MongoDB.
+    With with_text=False chunk_text is left out, which is all scoring needs.
+    With course set, only that course's chunks are loaded.
+    """
+    projection = {"embedding": 1, "normalized": 1, "pdf_file": 1, "chunk_index": 1, "course": 1}
+    if with_text:
+        projection["chunk_text"] = 1
+    cursor = chunks_coll.find({"course": course} if course else {}, projection)
+    ids, metadata, embeddings, normalized = [], [], [], []
     for doc in cursor:
+        ids.append(doc["_id"])
         embeddings.append(doc["embedding"])
-        metadata.append({
+        normalized.append(doc.get("normalized", False))
+        chunk = {
             "pdf_file": doc["pdf_file"],
             "chunk_index": doc["chunk_index"],
-            "chunk_text": doc["chunk_text"]
-        })
+            "course": doc.get("course") or tag_course(doc["pdf_file"])
+        }
+        if with_text:
+            chunk["chunk_text"] = doc["chunk_text"]
+        metadata.append(chunk)
 
     embeddings = np.array(embeddings, dtype=np.float32)
+    stale = ~np.array(normalized, dtype=bool)
+    if stale.any():
+        embeddings[stale] = normalize_rows(embeddings[stale])
+    return embeddings, ids, metadata
+
 
-    # Compute cosine similarity
-    similarities = np.dot(embeddings, query_emb) / (
-        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_emb)
-    )
-    top_indices = np.argsort(similarities)[-top_k:][::-1]
-    print("Top 10 similarity scores:", np.sort(similarities)[-10:])
-    # Filter by similarity threshold
-    results = []
-    for idx in top_indices:
-        if similarities[idx] >= similarity_threshold:
-            results.append({**metadata[idx], "score": float(similarities[idx])})
-    return results
+def export_vector_store(store_dir=None, vectors=None):
+    """
+    Publish every stored chunk to the on-disk vector store that backend
+    workers memory-map (see RAG_VECTOR_STORE_DIR).
+    """
+    store_dir = store_dir or os.getenv("RAG_VECTOR_STORE_DIR", DEFAULT_STORE_DIR)
+    embeddings, ids, metadata = vectors or load_chunk_vectors()
+    if not ids:
+        print("No chunks stored; skipping vector store export.")
+        return None
+    version = write_vector_store(embeddings, ids, metadata, store_dir)
+    print(f"Published vector store version {version} with {len(ids)} chunks to {store_dir}.")
+    return version
+
+
+def build_ann_index(kind=None, index_path=None, vectors=None):
+    """
+    Build the approximate nearest-neighbour index the backend searches
+    (see RAG_INDEX_BACKEND) over every stored chunk and write it to disk,
+    plus one index per course shard large enough to need one.
+    """
+    kind = kind or os.getenv("RAG_INDEX_BACKEND", "hnsw")
+    index_path = index_path or os.getenv("RAG_INDEX_PATH", DEFAULT_INDEX_PATH)
+    if kind == "exact":
+        print("RAG_INDEX_BACKEND is 'exact'; no ANN index to build.")
+        return None
+
+    embeddings, ids, metadata = vectors or load_chunk_vectors()
+    if not ids:
+        print("No chunks stored; skipping ANN index build.")
+        return None
+    ann_index = AnnIndex.build(embeddings, ids, kind=kind)
+    ann_index.save(index_path)
+    print(f"Built {kind} index over {len(ids)} chunks at {index_path}.")
+
+    for course, rows in rows_by_course(chunk["course"] for chunk in metadata).items():
+        if len(rows) < MIN_SHARD_INDEX_SIZE:
+            continue
+        shard_path = shard_index_path(index_path, course)
+        AnnIndex.build(embeddings[rows], [ids[row] for row in rows], kind=kind).save(shard_path)
+        print(f"Built {kind} index over {len(rows)} {course} chunks at {shard_path}.")
+    return ann_index
+
+
+def retrieve_relevant_chunks(query, model, top_k=5, similarity_threshold=0.3, course=None):
+    """
+    Retrieve the top_k most similar chunks for a given query, filtered by a similarity threshold.
+    """
+    return retrieve_many([query], model, top_k, similarity_threshold, course)[0]
+
+
+def retrieve_many(queries, model, top_k=5, similarity_threshold=0.3, course=None):
+    """
+    Retrieve the top_k most similar chunks for each query in one pass.
+    The queries are encoded as one batch and the corpus is loaded and scored once.
+    With course set, only chunks tagged with that course are loaded and scored.
+    Returns one result list per query, in the same order as queries.
+    """
+    query_embs = model.encode(queries, normalize_embeddings=True).astype(np.float32)
+    embeddings, ids, metadata = load_chunk_vectors(with_text=False, course=course)
+
+    # Compute cosine similarity; both sides are unit length
+    similarities = query_embs @ embeddings.T
+
+    selected = []
+    for row, query_emb in zip(similarities, query_embs):
+        print("Top 10 similarity scores:", row[top_k_indices(row, 10)][::-1])
+        # Filter by similarity threshold
+        selected.append([
+            (idx, score) for idx, score in zip(*rescored_top_k(row, embeddings, query_emb, top_k))
+            if score >= similarity_threshold
+        ])
+
+    # Fetch text only for the chunks that made the cut, in one $in lookup
+    texts = fetch_texts(chunks_coll, {ids[idx] for query_selected in selected for idx, _ in query_selected})
+    return [
+        [
+            {**metadata[idx], "chunk_text": texts[ids[idx]], "score": float(score)}
+            for idx, score in query_selected if ids[idx] in texts
+        ]
+        for query_selected in selected
+    ]
 
 def generate_rag_response(query, retrieved_chunks):
     """
     Generate a response using GPT with retrieved chunks as context,
     via the openai-python >=1.0.0 ChatCompletion client.
     """
-    # 1. Build the context string
-    context = "\n\n".join(
-        f"Chunk {i+1}: {chunk['chunk_text']}"
-        for i, chunk in enumerate(retrieved_chunks)
-    )
+    # 1. Build the context string: overlapping chunks merged, packed to the token budget
+    context, context_stats = context_builder.build(retrieved_chunks)
+    print(f"Context tokens: {context_stats['context_tokens']} (plain concatenation: {context_stats['naive_tokens']})")
 
     # 2. Assemble messages
     messages = [
@@ -209,7 +328,7 @@ def generate_rag_response(query, retrieved_chunks):
     ]
 
     try:
-        response = ai_client.chat.completions.create(
+        response = llm.chat(
             model="gpt-4",            # Changed from gpt-4o-mini to gpt-4
             messages=messages,
             max_tokens=300,           # Changed max_completion_tokens to max_tokens
@@ -255,6 +374,10 @@ def run_pdf_indexing(pdf_directory="downloaded_files", chunk_size=2000):
     if not metadata:
         return
     save_index_and_metadata(None, metadata)
+    backfill_courses()
+    vectors = load_chunk_vectors()
+    export_vector_store(vectors=vectors)
+    build_ann_index(vectors=vectors)
 
     # Interactive query with RAG
     # while True:
@@ -1,6 +1,7 @@
 
 import os
 import csv
+import json
 import time
 import requests
 from urllib.parse import urlparse
@@ -56,6 +57,7 @@ def is_valid_link(link, base_url):
 def download_file(url, session, download_dir="downloaded_files"):
     """
     Download a file (e.g., PDF) to the specified directory.
+    Returns the local file name, or None if the download failed.
     """
     os.makedirs(download_dir, exist_ok=True)
     local_filename = url.split('/')[-1] or "file"
@@ -67,8 +69,24 @@ def download_file(url, session, download_dir="downloaded_files"):
                 for chunk in r.iter_content(chunk_size=8192):
                     f.write(chunk)
         print(f"Downloaded: {local_filepath}")
+        return local_filename
     except Exception as e:
         print(f"Failed to download {url}. Reason: {e}")
+        return None
+
+def record_sources(filenames, website, download_dir="downloaded_files"):
+    """
+    Remember which page each downloaded file came from in sources.json,
+    so indexing can tag chunks with the course of that page.
+    """
+    manifest_path = os.path.join(download_dir, "sources.json")
+    sources = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            sources = json.load(f)
+    sources.update({filename: website for filename in filenames})
+    with open(manifest_path, "w") as f:
+        json.dump(sources, f, indent=2)
 
 def process_website(driver, session, website):
     """
@@ -86,10 +104,15 @@ def process_website(driver, session, website):
         links = gather_links(driver, base_domain)
 
         # Download only PDF files
+        downloaded = []
         for link in links:
             if link.lower().endswith(".pdf"):
-                download_file(link, session)
-                
+                filename = download_file(link, session)
+                if filename:
+                    downloaded.append(filename)
+        if downloaded:
+            record_sources(downloaded, website)
+
         return True
     except Exception as e:
         print(f"Error processing {website}: {e}")
@@ -1,5 +1,5 @@
 from web_scraper.web_scraper import run_web_scraper
-import store_pdf_mongo
+from scraper import store_pdf_mongo
 
 def main():
     # Configuration